@@ -16,6 +16,7 @@
 #
 # ##### END GPL LICENSE BLOCK #####
 
+import os
 import bpy
 from bpy.types import Context, Menu
 
@@ -67,6 +68,66 @@ def m3_import_id_names(self, context):
             yield ob.name, ob.name, 'Imports the M3 data into the selected object. Note that various data such as animations will not be imported.'
 
 
+class M3ImportSubsetItem( bpy.types.PropertyGroup ):
+    index: bpy.props.IntProperty(options=set()) # type: ignore
+    select: bpy.props.BoolProperty(options=set(), default=True) # type: ignore
+
+
+class M3ImportSubsetList( bpy.types.UIList ):
+    bl_idname = 'UI_UL_m3_import_subset'
+
+    def draw_item( self, context, layout, data, item, icon, active_data, active_propname, index ):
+        layout.prop( item, 'select', text=item.name )
+
+
+# (operator collection name, m3_scan key, label)
+import_subset_collections = (
+    ( 'subset_sequences', 'sequences', 'Animation Groups' ),
+    ( 'subset_regions', 'regions', 'Mesh Regions' ),
+    ( 'subset_particle_systems', 'particle_systems', 'Particle Systems' ),
+)
+
+
+def import_subset_scan( op, filepath ):
+    '''Fills the subset collections of the import operator with the contents of the m3 file at filepath'''
+    op.subset_filepath = filepath
+
+    for collection_name, key, label in import_subset_collections:
+        getattr( op, collection_name ).clear()
+
+    if not os.path.isfile( filepath ):
+        return
+
+    try:
+        scan = io_m3_import.m3_scan( filepath )
+    except Exception:
+        return  # not a readable m3 file
+
+    for collection_name, key, label in import_subset_collections:
+        collection = getattr( op, collection_name )
+        for index, name in scan[key]:
+            item = collection.add()
+            item.name = name
+            item.index = index
+
+
+class M3ImportSubsetScan( bpy.types.Operator ):
+    '''Lists the animation groups, mesh regions and particle systems of the selected file, so that they can be chosen for import'''
+    bl_idname       = 'm3.import_subset_scan'
+    bl_label        = 'List File Contents'
+    bl_options      = {'INTERNAL'}
+
+    @classmethod
+    def poll( cls, context ):
+        return hasattr( getattr( context.space_data, 'active_operator', None ), 'subset_filepath' )
+
+    def execute( self, context ):
+        params = context.space_data.params
+        directory = params.directory.decode() if type( params.directory ) == bytes else params.directory
+        import_subset_scan( context.space_data.active_operator, os.path.join( directory, params.filename ) )
+        return {'FINISHED'}
+
+
 class M3ImportOperator( bpy.types.Operator ):
     '''Load an M3 file into a new armature or an existing armature'''
     bl_idname       = 'm3.import'
@@ -82,6 +143,33 @@ class M3ImportOperator( bpy.types.Operator ):
     get_effects: bpy.props.BoolProperty(default=False, name='Effects', description='Imports effect data, such as particle systems or ribbons, and their associated materials. Applies only to m3 (not m3a) import') # type: ignore
     get_rig: bpy.props.BoolProperty(default=False, name='Rig', description='Imports bones and various bone related data. (Attachment points, hit test volumes, etc.) Applies only to m3 (not m3a) import') # type: ignore
     get_anims: bpy.props.BoolProperty(default=False, name='Animations', description='Imports animation data. Applies only to m3 (not m3a) import') # type: ignore
+    use_modal: bpy.props.BoolProperty( # type: ignore
+        default=False, options={'HIDDEN', 'SKIP_SAVE'},
+        description='Decodes the file in the background and builds the data over several UI updates, so that the import can be followed and cancelled',
+    )
+    use_key_reduction: bpy.props.BoolProperty( # type: ignore
+        default=False, name='Reduce Keyframes',
+        description='Removes animation keys which the remaining keys reproduce within the tolerance, since many m3 animations have a key on every frame',
+    )
+    key_reduction_tolerance: bpy.props.FloatProperty( # type: ignore
+        default=0.0005, min=0, precision=5, step=0.01, name='Tolerance',
+        description='Largest allowed difference of the reduced animation from the original. Rotations use this as an angle in radians',
+    )
+    write_timings: bpy.props.BoolProperty( # type: ignore
+        default=False, name='Write Timing Report',
+        description='Writes the time taken by each import stage and the amount of imported data to a .import_timings.json file next to the imported file',
+    )
+    use_subset: bpy.props.BoolProperty( # type: ignore
+        default=False, name='Import Subset',
+        description='Lists the animation groups, mesh regions and particle systems of the selected file, so that only the chosen ones are decoded and imported',
+    )
+    subset_filepath: bpy.props.StringProperty(options={'HIDDEN', 'SKIP_SAVE'}) # type: ignore
+    subset_sequences: bpy.props.CollectionProperty(type=M3ImportSubsetItem, options={'HIDDEN', 'SKIP_SAVE'}) # type: ignore
+    subset_sequences_index: bpy.props.IntProperty(options={'HIDDEN', 'SKIP_SAVE'}) # type: ignore
+    subset_regions: bpy.props.CollectionProperty(type=M3ImportSubsetItem, options={'HIDDEN', 'SKIP_SAVE'}) # type: ignore
+    subset_regions_index: bpy.props.IntProperty(options={'HIDDEN', 'SKIP_SAVE'}) # type: ignore
+    subset_particle_systems: bpy.props.CollectionProperty(type=M3ImportSubsetItem, options={'HIDDEN', 'SKIP_SAVE'}) # type: ignore
+    subset_particle_systems_index: bpy.props.IntProperty(options={'HIDDEN', 'SKIP_SAVE'}) # type: ignore
 
     def draw( self, context: Context ):
         layout = self.layout
@@ -97,15 +185,112 @@ class M3ImportOperator( bpy.types.Operator ):
             row = col.row()
             row.active = self.get_rig
             row.prop( self, 'get_anims' )
+        layout.separator()
+        layout.prop( self, 'use_key_reduction' )
+        row = layout.row()
+        row.active = self.use_key_reduction
+        row.prop( self, 'key_reduction_tolerance' )
+        layout.prop( self, 'write_timings' )
+        layout.prop( self, 'use_subset' )
+
+        if self.use_subset:
+            # scanning writes the subset collections, which draw must not do, so it is run by its own operator
+            layout.operator( M3ImportSubsetScan.bl_idname, icon='FILE_REFRESH' )
+
+            if not self.subset_filepath_matches():
+                return
+
+            for collection_name, key, label in import_subset_collections:
+                if not len( getattr( self, collection_name ) ):
+                    continue
+                layout.label( text=label )
+                layout.template_list( M3ImportSubsetList.bl_idname, collection_name, self, collection_name, self, collection_name + '_index', rows=4 )
+
+    def subset_filepath_matches( self ):
+        return bool( self.subset_filepath ) and os.path.normpath( self.subset_filepath ) == os.path.normpath( self.filepath )
+
+    def timings_path_get( self ):
+        return os.path.splitext( self.filepath )[0] + '.import_timings.json' if self.write_timings else ''
+
+    def key_tolerance_get( self ):
+        return self.key_reduction_tolerance if self.use_key_reduction else 0.0
+
+    def subset_get( self ):
+        if not self.use_subset or not self.subset_filepath_matches():
+            return None
+        return { key: { item.index for item in getattr( self, collection_name ) if item.select } for collection_name, key, label in import_subset_collections }
 
     def invoke( self, context, event ):
+        self.use_modal = True
         context.window_manager.fileselect_add( self )
         return {'RUNNING_MODAL'}
 
     def execute( self, context: Context ):
         opts = ( self.get_rig, self.get_anims, self.get_mesh, self.get_effects )
-        io_m3_import.m3_import( filepath=self.filepath, ob=bpy.data.objects.get(self.id_name), bl_op=self, opts=opts )
-        return {'FINISHED'}
+        subset = self.subset_get()
+
+        if not self.use_modal or bpy.app.background:
+            io_m3_import.m3_import( filepath=self.filepath, ob=bpy.data.objects.get(self.id_name), bl_op=self, opts=opts, subset=subset, timings_path=self.timings_path_get(), key_tolerance=self.key_tolerance_get() )
+            return {'FINISHED'}
+
+        # file decoding runs in a thread, then each import stage is run on its own timer event
+        self.load_thread = io_m3_import.M3LoadThread( self.filepath, lazy=bool( subset ) )
+        self.load_thread.start()
+        self.import_stages = None
+
+        wm = context.window_manager
+        self.timer = wm.event_timer_add( 0.05, window=context.window )
+        wm.modal_handler_add( self )
+        wm.progress_begin( 0, 100 )
+        context.workspace.status_text_set( 'Decoding M3 file... (Esc to cancel)' )
+
+        return {'RUNNING_MODAL'}
+
+    def modal( self, context, event ):
+        if event.type == 'ESC' and event.value == 'PRESS':
+            self.modal_end( context )
+
+            if self.import_stages is None:
+                # the file is otherwise closed by the import stages, which were never started
+                self.load_thread.cancel()
+                self.report( {'WARNING'}, 'M3 import cancelled' )
+                return {'CANCELLED'}
+
+            self.import_stages.close()
+            self.report( {'WARNING'}, 'M3 import cancelled, the data imported so far can be undone' )
+            return {'FINISHED'}
+
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+
+        if self.import_stages is None:
+            if self.load_thread.is_alive():
+                return {'PASS_THROUGH'}
+
+            if self.load_thread.exception_trace:
+                self.modal_end( context )
+                print( self.load_thread.exception_trace )
+                self.report( {'ERROR'}, self.load_thread.exception_trace )
+                return {'CANCELLED'}
+
+            opts = ( self.get_rig, self.get_anims, self.get_mesh, self.get_effects )
+            self.import_stages = io_m3_import.m3_import_stages( filepath=self.filepath, ob=bpy.data.objects.get(self.id_name), bl_op=self, opts=opts, m3=self.load_thread.m3, subset=self.subset_get(), timings_path=self.timings_path_get(), load_seconds=self.load_thread.seconds, key_tolerance=self.key_tolerance_get() )
+
+        try:
+            ii, count, name = next( self.import_stages )
+        except StopIteration:
+            self.modal_end( context )
+            return {'FINISHED'}
+
+        context.window_manager.progress_update( 100 * ii // count )
+        context.workspace.status_text_set( f'Importing M3: {name.replace("_", " ")} ({ii + 1}/{count}) (Esc to cancel)' )
+
+        return {'RUNNING_MODAL'}
+
+    def modal_end( self, context ):
+        context.window_manager.event_timer_remove( self.timer )
+        context.window_manager.progress_end()
+        context.workspace.status_text_set( None )
 
 
 class M3ExportOperator( bpy.types.Operator ):
@@ -125,6 +310,11 @@ class M3ExportOperator( bpy.types.Operator ):
     cull_unused_bones: bpy.props.BoolProperty(default=True, name='Cull Unused Bones', description='Bones which the exporter determines will not be referenced in the m3 file are removed') # type: ignore
     cull_material_layers: bpy.props.BoolProperty(default=True, name='Cull Material Layers', description='Fills all blank material layer slots with a reference to a single layer section, which reduces file size. When turned off, output will conform to Blizzard standards, where all available material layer slots are filled with a unique layer section.') # type: ignore
     use_only_max_bounds: bpy.props.BoolProperty(default=False, name='Use Only Max Bounds', description='Rather than having multiple bounding box keys, animations will have exactly one bounding box key which has the maximum dimensions of all the keys there would have been. Can slightly reduce file size') # type: ignore
+    use_cache: bpy.props.BoolProperty( # type: ignore
+        default=True, name='Reuse Unchanged Data',
+        description='Reuse the vertex data of unchanged meshes and the bone animation of unchanged actions from a previous export of the open file. '
+                    'The output is the same as without reuse',
+    )
 
     @classmethod
     def poll(cls, context):
@@ -198,6 +388,9 @@ def m3_module_classes():
 classes = (
     *shared.classes,
     *m3_module_classes(),
+    M3ImportSubsetItem,
+    M3ImportSubsetList,
+    M3ImportSubsetScan,
     M3ImportOperator,
     M3ExportOperator,
 )
@@ -221,6 +414,12 @@ def register():
     bpy.app.handlers.load_post.append( m3_attachmentpoints.attachment_name_list_verify )
     # for backwards compatibility with the names of attachment points from previous importer versions
     bpy.app.handlers.load_post.append( m3_attachmentpoints.attachmentpoint_names_fix )
+    # cached handle lookups and anim id paths refer to the data of the previously loaded file or undo step
+    bpy.app.handlers.load_post.append( shared.m3_pointer_cache_clear_handler )
+    bpy.app.handlers.undo_post.append( shared.m3_pointer_cache_clear_handler )
+    bpy.app.handlers.redo_post.append( shared.m3_pointer_cache_clear_handler )
+    # data reused between exports belongs to the previously loaded file
+    bpy.app.handlers.load_post.append( io_m3_export.export_cache_clear_handler )
 
 
 def unregister():
@@ -235,6 +434,12 @@ def unregister():
 
     bpy.types.SpaceView3D.draw_handler_remove( M3_SHADER, 'WINDOW' )
 
+    for handlers in ( bpy.app.handlers.load_post, bpy.app.handlers.undo_post, bpy.app.handlers.redo_post ):
+        if shared.m3_pointer_cache_clear_handler in handlers:
+            handlers.remove( shared.m3_pointer_cache_clear_handler )
+    if io_m3_export.export_cache_clear_handler in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.remove( io_m3_export.export_cache_clear_handler )
+
 
 if __name__ == '__main__':
     register()
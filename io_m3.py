@@ -559,6 +559,12 @@ class M3SectionList( list ):
 
         return self
 
+    def close( self ):
+        ''' Closes the file of a lazily loaded section list, sections which were not accessed can no longer be loaded '''
+        if self.file:
+            self.file.close()
+            self.file = None
+
     def save(self, filepath=None):
         buffer_offset = 0
         for section in self:
@@ -763,4 +769,63 @@ class M3Section:
         self.content = [ord(c) for c in string] + [0x00]
 
 
+class M3SectionLayout:
+    '''
+        Plans insertions into an M3SectionList relative to sections already placed, then applies them in a single pass.
+        Insertions behave like consecutive list.insert calls at an advancing position, without each one shifting the list.
+        '''
+
+    def __init__(self, sections):
+        self.sections = sections
+        self.head = M3Section(desc=None, index_entry=None, references=[], content=[])
+        self.next = {}
+        self.prev = {}
+
+        prev_section = self.head
+        for section in sections:
+            self.next[prev_section] = section
+            self.prev[section] = prev_section
+            prev_section = section
+        self.next[prev_section] = None
+
+    def cursor_before(self, section):
+        return M3SectionLayoutCursor(self, self.prev[section])
+
+    def cursor_after(self, section):
+        return M3SectionLayoutCursor(self, section)
+
+    def link_after(self, prev_section, section):
+        next_section = self.next[prev_section]
+        self.next[prev_section] = section
+        self.prev[section] = prev_section
+        self.next[section] = next_section
+        if next_section is not None:
+            self.prev[next_section] = section
+
+    def apply(self):
+        ordered = []
+        section = self.next[self.head]
+        while section is not None:
+            ordered.append(section)
+            section = self.next[section]
+        list.__setitem__(self.sections, slice(None), ordered)
+
+
+class M3SectionLayoutCursor:
+    ''' Position of an M3SectionLayout which advances past each section inserted or skipped '''
+
+    def __init__(self, layout, prev_section):
+        self.layout = layout
+        self.prev_section = prev_section
+
+    def insert(self, section):
+        self.layout.link_after(self.prev_section, section)
+        self.prev_section = section
+
+    def skip(self):
+        next_section = self.layout.next[self.prev_section]
+        if next_section is not None:
+            self.prev_section = next_section
+
+
 structures = structures_from_tree()
@@ -0,0 +1,184 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+'''
+    Headless batch import of m3 files, each file being imported into its own armature object.
+
+    blender -b --addons io_scene_m3_sc2 --python-expr "import io_scene_m3_sc2.io_m3_batch as m; m.main()" -- "models/**/*.m3" --save each --output-dir out --jobs 4
+
+    All files imported by one process share the loaded structures schema and addon registration.
+    With --jobs N, the files are split over N background blender processes whose reports are merged,
+    which cannot save a combined .blend.
+'''
+
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import bpy
+from . import io_m3_import
+
+
+class BatchReport:
+    '''Stands in for the import operator so that import reports can be collected per file'''
+
+    def __init__(self):
+        self.warnings = []
+        self.errors = []
+        self.infos = []
+
+    def report(self, report_type, message):
+        if 'ERROR' in report_type:
+            self.errors.append(message)
+        elif 'WARNING' in report_type:
+            self.warnings.append(message)
+        else:
+            self.infos.append(message)
+
+
+def expand_filepaths(patterns):
+    filepaths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else [pattern]
+        for filepath in matches:
+            if filepath.lower().endswith('.m3') and filepath not in filepaths:
+                filepaths.append(filepath)
+    return filepaths
+
+
+def blend_path_get(output_dir, filepath):
+    return os.path.join(output_dir, os.path.splitext(os.path.basename(filepath))[0] + '.blend')
+
+
+def data_clear(keep_objects):
+    for ob in [ob for ob in bpy.data.objects if ob not in keep_objects]:
+        bpy.data.objects.remove(ob)
+    bpy.data.orphans_purge(do_local_ids=True, do_linked_ids=True, do_recursive=True)
+
+
+def batch_import(filepaths, save_mode='NONE', output_dir='', combined_name='combined.blend', key_tolerance=0.0):
+    '''
+        Imports each file into a new armature object and returns a list of per file report dicts.
+        save_mode is one of NONE, EACH (one .blend per file) or COMBINED (one .blend for all files).
+        Animation keys are reduced within key_tolerance if it is not 0.
+        '''
+    reports = []
+    keep_objects = set(bpy.data.objects)
+
+    if save_mode != 'NONE':
+        os.makedirs(output_dir or os.getcwd(), exist_ok=True)
+
+    for filepath in filepaths:
+        batch_report = BatchReport()
+        obs_before = set(bpy.data.objects)
+
+        time_start = time.perf_counter()
+        io_m3_import.m3_import(filepath=filepath, bl_op=batch_report, key_tolerance=key_tolerance)
+        time_import = time.perf_counter() - time_start
+
+        ob_names = [ob.name for ob in bpy.data.objects if ob not in obs_before and ob.type == 'ARMATURE']
+        report = {
+            'filepath': filepath,
+            'seconds': round(time_import, 4),
+            'objects': ob_names,
+            'warnings': batch_report.warnings,
+            'errors': batch_report.errors,
+            'timings': batch_report.infos,
+        }
+
+        if save_mode == 'EACH':
+            report['blend'] = blend_path_get(output_dir, filepath)
+            bpy.ops.wm.save_as_mainfile(filepath=report['blend'], copy=True)
+            data_clear(keep_objects)
+
+        reports.append(report)
+        print(f'M3 batch import: {filepath} ({time_import:.3f}s, {len(report["warnings"])} warnings, {len(report["errors"])} errors)')
+
+    if save_mode == 'COMBINED' and filepaths:
+        bpy.ops.wm.save_as_mainfile(filepath=os.path.join(output_dir, combined_name), copy=True)
+
+    return reports
+
+
+def batch_import_processes(filepaths, jobs, save_mode='NONE', output_dir='', key_tolerance=0.0):
+    '''Splits the files over several background blender processes and merges their reports'''
+    procs = []
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for ii in range(jobs):
+            job_filepaths = filepaths[ii::jobs]
+            if not job_filepaths:
+                continue
+
+            report_path = os.path.join(temp_dir, f'report_{ii}.json')
+            args = [
+                bpy.app.binary_path, '-b', '--addons', __package__,
+                '--python-expr', f'import {__name__} as m; m.main()', '--',
+                *job_filepaths, '--save', save_mode.lower(), '--output-dir', output_dir, '--report', report_path,
+                '--key-tolerance', str(key_tolerance),
+            ]
+            procs.append((subprocess.Popen(args), report_path, job_filepaths))
+
+        reports = []
+        for proc, report_path, job_filepaths in procs:
+            proc.wait()
+            try:
+                with open(report_path) as f:
+                    reports.extend(json.load(f))
+            except (OSError, ValueError):
+                for filepath in job_filepaths:
+                    reports.append({'filepath': filepath, 'errors': [f'Batch process exited with code {proc.returncode} without a report']})
+
+    return reports
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+
+    parser = argparse.ArgumentParser(prog='io_m3_batch', description='Imports m3 files into armature objects without the user interface')
+    parser.add_argument('files', nargs='+', help='m3 file paths or glob patterns (** is recursive)')
+    parser.add_argument('--save', choices=('none', 'each', 'combined'), default='none', help='save one .blend per file or one .blend for all files')
+    parser.add_argument('--output-dir', default='', help='directory of the saved .blend files')
+    parser.add_argument('--combined-name', default='combined.blend', help='file name of the combined .blend')
+    parser.add_argument('--report', default='', help='path of the JSON report, printed to stdout if not given')
+    parser.add_argument('--jobs', type=int, default=1, help='number of background blender processes to import with')
+    parser.add_argument('--key-tolerance', type=float, default=0.0, help='remove animation keys reproduced by the remaining keys within this tolerance')
+    args = parser.parse_args(argv)
+
+    if args.jobs > 1 and args.save == 'combined':
+        parser.error('--save combined requires --jobs 1, since each process saves its own .blend')
+
+    filepaths = expand_filepaths(args.files)
+
+    if args.jobs > 1:
+        reports = batch_import_processes(filepaths, args.jobs, args.save.upper(), args.output_dir, args.key_tolerance)
+    else:
+        reports = batch_import(filepaths, args.save.upper(), args.output_dir, args.combined_name, args.key_tolerance)
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(reports, f, indent=2)
+    else:
+        print(json.dumps(reports, indent=2))
+
+    return reports
@@ -18,10 +18,14 @@
 
 import bpy
 import bmesh
+import collections
+import hashlib
 import mathutils
 import os
 import traceback
 import math
+import numpy as np
+from bpy.app.handlers import persistent
 from . import bl_enum
 from . import io_m3
 from . import io_shared
@@ -60,6 +64,36 @@ def to_m3_vec3(bl_vec=None):
     return m3_vec
 
 
+def struct_dtype_get(desc):
+    '''Numpy structured dtype with the same memory layout as the m3 structure description'''
+    names, formats, offsets = [], [], []
+    offset = 0
+    for field in desc.fields.values():
+        names.append(field.name)
+        formats.append(struct_dtype_get(field.desc) if type(field) == io_m3.M3FieldStructure else field.struct_format.format)
+        offsets.append(offset)
+        offset += field.size
+    return np.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': desc.size})
+
+
+def tri_tangents_get(tri_cos, tri_uvs):
+    '''
+        Returns the normalized tangents and handedness signs (0 or 255) of triangles from arrays of their corner positions and uvs.
+        Triangles with degenerate uvs get zero tangents.
+        '''
+    c1, c2, c3 = tri_cos[:, 0], tri_cos[:, 1], tri_cos[:, 2]
+    u1, u2, u3 = tri_uvs[:, 0, 0], tri_uvs[:, 1, 0], tri_uvs[:, 2, 0]
+    v1, v2, v3 = tri_uvs[:, 0, 1], tri_uvs[:, 1, 1], tri_uvs[:, 2, 1]
+
+    d = (v2 - v1) * (u3 - u1) - (u2 - u1) * (v3 - v1)
+    tans = ((v3 - v1)[:, None] * (c2 - c1) - (v2 - v1)[:, None] * (c3 - c1)) / -np.where(d == 0, 1.0, d)[:, None]
+
+    lengths = np.linalg.norm(tans, axis=1)
+    tans = np.where(((d != 0) & (lengths > 0))[:, None], tans / np.where(lengths == 0, 1.0, lengths)[:, None], 0.0)
+
+    return tans, np.where(d < 0, 0, 255)
+
+
 def to_m3_vec3_uint8(bl_vec=None):
     m3_vec = io_m3.structures['Vector3As3uint8'].get_version(0).instance()
     if bl_vec:
@@ -131,26 +165,97 @@ ANIM_VEC_DATA_SETTINGS = {
 }
 
 
+def pose_needs_depsgraph(ob):
+    '''True if pose bone matrices may not follow from the channels of the bones alone, so that poses must be evaluated per frame'''
+    if ob.data.pose_position != 'POSE':
+        return True
+
+    for id_data in (ob, ob.data):
+        anim_data = id_data.animation_data
+        if anim_data is None:
+            continue
+        if len(anim_data.drivers):
+            return True
+        if anim_data.use_nla and any(not track.mute for track in anim_data.nla_tracks):
+            return True
+
+    for pb in ob.pose.bones:
+        if len(pb.constraints):
+            return True
+        bone = pb.bone
+        if not bone.use_inherit_rotation or bone.inherit_scale != 'FULL' or not bone.use_local_location:
+            return True
+
+    return False
+
+
+def pose_bone_basis_matrices(pb, fcurves, frames):
+    '''Local space matrices of the pose bone on each frame, evaluated from the given fcurves of an action'''
+    def channel_values(prop, count):
+        # channels without an fcurve keep the value they currently have
+        data_path = pb.path_from_id(prop)
+        channel_fcurves = [fcurves.get((data_path, ii)) for ii in range(count)]
+        channel_fcurves = [fcurve if fcurve and not fcurve.mute else None for fcurve in channel_fcurves]
+        return fcurves_evaluate(channel_fcurves, frames, tuple(getattr(pb, prop)))
+
+    locs = channel_values('location', 3).tolist()
+    scls = channel_values('scale', 3).tolist()
+
+    if pb.rotation_mode == 'QUATERNION':
+        rots = [mathutils.Quaternion(val).normalized() for val in channel_values('rotation_quaternion', 4).tolist()]
+    elif pb.rotation_mode == 'AXIS_ANGLE':
+        rots = [mathutils.Quaternion(val[1:], val[0]) for val in channel_values('rotation_axis_angle', 4).tolist()]
+    else:
+        rots = [mathutils.Euler(val, pb.rotation_mode).to_quaternion() for val in channel_values('rotation_euler', 3).tolist()]
+
+    return [mathutils.Matrix.LocRotScale(loc, rot, scl) for loc, rot, scl in zip(locs, rots, scls)]
+
+
+# values of the keyframe interpolation enum, as read with foreach_get
+KEYFRAME_INTERPOLATION_VALUES = {'CONSTANT': 0, 'LINEAR': 1, 'BEZIER': 2}
+
+
 def get_fcurve_anim_frames(fcurve, interpolation='LINEAR'):
     if fcurve is None or not len(fcurve.keyframe_points):
         return
 
     frames = []
 
+    keyframe_points = fcurve.keyframe_points
+    key_frames = fcurve_key_frames(fcurve).tolist()
+    interps = np.empty(len(keyframe_points), dtype=np.int32)
+    keyframe_points.foreach_get('interpolation', interps)
+
+    interpolation = KEYFRAME_INTERPOLATION_VALUES[interpolation]
     last_interp = interpolation
-    last_frame = round(fcurve.keyframe_points[0].co.x)
-    for point in fcurve.keyframe_points:
-        frame = round(point.co.x)
-        if last_interp != interpolation and last_interp != 'CONSTANT':
-            for f in range(last_frame, frame):
-                frames.append(f)
-        last_interp = point.interpolation
-        last_frame = round(point.co.x)
+    last_frame = round(key_frames[0])
+    for key_frame, interp in zip(key_frames, interps.tolist()):
+        frame = round(key_frame)
+        if last_interp != interpolation and last_interp != KEYFRAME_INTERPOLATION_VALUES['CONSTANT']:
+            frames.extend(range(last_frame, frame))
+        last_interp = interp
+        last_frame = frame
         frames.append(frame)
 
     return frames
 
 
+def fcurve_key_frames(fcurve):
+    cos = np.empty(len(fcurve.keyframe_points) * 2, dtype=np.float32)
+    fcurve.keyframe_points.foreach_get('co', cos)
+    return cos[0::2]
+
+
+def fcurves_evaluate(fcurves, frames, defaults):
+    '''Array of the fcurve values on each frame, with the default value for components without an fcurve'''
+    values = np.empty((len(frames), len(fcurves)))
+    values[:] = defaults
+    for ii, fcurve in enumerate(fcurves):
+        if fcurve is not None:
+            values[:, ii] = [fcurve.evaluate(frame) for frame in frames]
+    return values
+
+
 def quats_compatibility(quats):
     if len(quats) < 2:
         return
@@ -169,59 +274,32 @@ def float_equal(val0, val1):
     return abs(val0 - val1) < 0.0005
 
 
-def vec_interp(left, right, factor):
-    return left.lerp(right, factor)
-
-
 def vec_equal(val0, val1):
     return (val0 - val1).length < 0.0005
 
 
-def quat_interp(left, right, factor):
-    return left.slerp(right, factor)
-
-
 def quat_equal(val0, val1):
     dist = (val0.x - val1.x) ** 2 + (val0.y - val1.y) ** 2 + (val0.z - val1.z) ** 2 + (val0.w - val1.w) ** 2
     return dist < 0.00000001
 
 
-def simplify_anim_data_with_interp(keys, keyframes, vals, interp_func, equal_func):
-    if len(vals) < 2:
+def simplify_anim_data(keys, keyframes, vals, interpolation='LINEAR'):
+    '''
+        Removes the values which the remaining values reproduce within tolerance, by splitting each span at its worst interpolated value.
+        First and last values and values on manually set keyframes are always kept. interpolation is one of LINEAR or SLERP.
+        '''
+    if len(vals) < 3:
         return keys, vals
 
-    left_key, curr_key = keys[:2]
-    left_val, curr_val = vals[:2]
-    new_keys = [left_key]
-    new_vals = [left_val]
-
-    for right_key, right_val in zip(keys[2:], vals[2:]):
-
-        # include key if it was manually set, even if it can be interpolated
-        if curr_key in keyframes:
-            new_keys.append(curr_key)
-            new_vals.append(curr_val)
-            left_key = curr_key
-            left_val = curr_val
-            curr_key = right_key
-            curr_val = right_val
-            continue
-
-        interpolated_val = interp_func(left_val, right_val, (curr_key - left_key) / (right_key - left_key))
-        if equal_func(interpolated_val, curr_val):
-            pass  # ignore current value since since it matches the given interpolation
-        else:
-            new_keys.append(curr_key)
-            new_vals.append(curr_val)
-            left_key = curr_key
-            left_val = curr_val
-        curr_key = right_key
-        curr_val = right_val
+    frames = np.array(keys, dtype=np.float64)
+    values = np.array([tuple(val) for val in vals], dtype=np.float64)
+    # quaternions are compared by the angle between the rotations, which is about twice their distance
+    tolerance = 0.0002 if interpolation == 'SLERP' else 0.0005
 
-    new_keys.append(keys[-1])
-    new_vals.append(vals[-1])
+    keep = io_shared.keys_reduce(frames, values, tolerance, interpolation, keep=np.isin(frames, list(keyframes)))
+    kept_indices = np.flatnonzero(keep).tolist()
 
-    return new_keys, new_vals
+    return [keys[ii] for ii in kept_indices], [vals[ii] for ii in kept_indices]
 
 
 def vec_list_contains_not_only(vec_list, vec):
@@ -238,17 +316,100 @@ def quat_list_contains_not_only(quat_list, quat):
     return False
 
 
+# corner selection of an axis aligned box, picking max over min per axis
+BOX_CORNERS = np.array([[(ii >> axis) & 1 for axis in range(3)] for ii in range(8)], dtype=bool)
+
+
+def bounding_arrays_from_bones(bone_rest_bounds, bone_to_matrix_dicts):
+    '''Min and max arrays of the bone bounding box corners transformed by each of the given bone matrix dicts'''
+    bones = list(bone_rest_bounds.keys())
+    corners = np.array([np.where(BOX_CORNERS, co_max, co_min) for co_min, co_max in bone_rest_bounds.values()])
+    matrices = np.array([[bone_to_matrix[bone] for bone in bones] for bone_to_matrix in bone_to_matrix_dicts])
+
+    cos = np.einsum('fbij,bkj->fbki', matrices[:, :, :3, :3], corners) + matrices[:, :, None, :3, 3]
+    return cos.min(axis=(1, 2)), cos.max(axis=(1, 2))
+
+
 def bounding_vectors_from_bones(bone_rest_bounds, bone_to_matrix_dict):
-    vals = ([], [], [])
-    for bone, coords in bone_rest_bounds.items():
-        matrix = bone_to_matrix_dict[bone]
-        for co in coords:
-            mat_co = matrix @ co
-            vals[0].append(mat_co.x)
-            vals[1].append(mat_co.y)
-            vals[2].append(mat_co.z)
+    bnds_min, bnds_max = bounding_arrays_from_bones(bone_rest_bounds, [bone_to_matrix_dict])
+    return mathutils.Vector(bnds_min[0].tolist()), mathutils.Vector(bnds_max[0].tolist())
 
-    return mathutils.Vector(min(val) for val in vals), mathutils.Vector(max(val) for val in vals)
+
+# data of the previous export of each mesh and action, keyed by (kind, name): (fingerprint, data), least recently used first
+export_cache = collections.OrderedDict()
+EXPORT_CACHE_SIZE = 64
+
+
+@persistent
+def export_cache_clear_handler(*args):
+    export_cache.clear()
+
+
+def fingerprint_get(*items):
+    '''Digest of the given values, where numpy arrays are hashed by their contents'''
+    digest = hashlib.blake2b(digest_size=20)
+    for item in items:
+        if isinstance(item, np.ndarray):
+            digest.update(repr((item.dtype.str, item.shape)).encode('utf-8'))
+            digest.update(np.ascontiguousarray(item).tobytes())
+        else:
+            digest.update(repr(item).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def foreach_array(collection, attr, dtype, size=1):
+    array = np.empty(len(collection) * size, dtype=dtype)
+    collection.foreach_get(attr, array)
+    return array.reshape(-1, size) if size > 1 else array
+
+
+class MeshArrays:
+    '''Arrays of the evaluated and triangulated mesh of an object, read once per export so that export stages can share them'''
+
+    def __init__(self, ob, depsgraph):
+        ob_eval = ob.evaluated_get(depsgraph)
+        me = ob_eval.to_mesh()
+
+        try:
+            me.calc_loop_triangles()
+
+            self.co = foreach_array(me.vertices, 'co', np.float32, 3)
+            self.normals = foreach_array(me.vertices, 'normal', np.float32, 3)
+            self.loop_verts = foreach_array(me.loops, 'vertex_index', np.int32)
+            self.poly_loop_starts = foreach_array(me.polygons, 'loop_start', np.int32)
+            self.poly_loop_totals = foreach_array(me.polygons, 'loop_total', np.int32)
+            self.tri_loops = foreach_array(me.loop_triangles, 'loops', np.int32)
+            self.tri_verts = self.loop_verts[self.tri_loops]
+
+            self.uv_layer_names = [uv_layer.name for uv_layer in me.uv_layers]
+            self.loop_uvs = {uv_layer.name: foreach_array(uv_layer.data, 'uv', np.float32, 2) for uv_layer in me.uv_layers}
+            self.loop_colors = {vertex_col.name: foreach_array(vertex_col.data, 'color', np.float32, 4) for vertex_col in me.vertex_colors}
+
+            clothsim = me.attributes.get('m3clothsim')
+            if clothsim and clothsim.domain == 'POINT' and clothsim.data_type == 'INT':
+                self.clothsim = foreach_array(clothsim.data, 'value', np.int32)
+            else:
+                self.clothsim = np.zeros(len(me.vertices), dtype=np.int32)
+
+            # vertex group weights, flattened in vertex order. bpy only gives access to them per vertex, since they are not mesh attributes
+            deform_data = [(ii, vert_group.group, vert_group.weight) for ii, vert in enumerate(me.vertices) for vert_group in vert.groups]
+            deform_data = np.array(deform_data, dtype=np.float64).reshape(-1, 3)
+
+            self.deform_verts = deform_data[:, 0].astype(np.int32)
+            self.deform_groups = deform_data[:, 1].astype(np.int32)
+            self.deform_weights = deform_data[:, 2]
+        finally:
+            ob_eval.to_mesh_clear()
+
+    def co_transformed(self, matrix):
+        return self.co @ np.array(matrix.to_3x3(), dtype=np.float32).T + np.array(matrix.translation, dtype=np.float32)
+
+    def vert_group_pairs(self):
+        '''List of the (group index, weight) pairs of each vertex'''
+        pairs = [[] for ii in range(len(self.co))]
+        for vert, group, weight in zip(self.deform_verts.tolist(), self.deform_groups.tolist(), self.deform_weights.tolist()):
+            pairs[vert].append((group, weight))
+        return pairs
 
 
 class M3OutputProcessor:
@@ -263,10 +424,11 @@ class M3OutputProcessor:
         type_ob = float if anim_data_tag == 'SDR3' else int
         head = getattr(self.bl, field + '_header')
         head.hex_id = head.hex_id  # set hex_id to itself to verify
+        data_path = self.bl.path_from_id(field)
 
         is_animated = False
         for action in self.exporter.action_to_anim_data:
-            fcurve = action.fcurves.find(self.bl.path_from_id(field))
+            fcurve = self.exporter.action_fcurves_get(action).get((data_path, 0))
             frames = get_fcurve_anim_frames(fcurve)
 
             if not frames:
@@ -282,51 +444,29 @@ class M3OutputProcessor:
     def collect_anim_data_vector(self, field, anim_data_tag):
         head = getattr(self.bl, field + '_header')
         head.hex_id = head.hex_id  # set hex_id to itself to verify
+        data_path = self.bl.path_from_id(field)
 
         is_animated = False
         vec_data_settings = ANIM_VEC_DATA_SETTINGS[anim_data_tag]
         for action in self.exporter.action_to_anim_data:
-            animated = False
-            fcurves = []
-            for ii in range(vec_data_settings['length']):
-                fcurve = action.fcurves.find(self.bl.path_from_id(field), index=ii)
-
-                if fcurve:
-                    fcurves.append(fcurve)
-                    animated = True
-                else:
-                    fcurves.append(None)
+            action_fcurves = self.exporter.action_fcurves_get(action)
+            fcurves = [action_fcurves.get((data_path, ii)) for ii in range(vec_data_settings['length'])]
 
-            if not animated:
-                continue
-
-            frames = []
+            frames = set()
             for fcurve in fcurves:
-                if fcurve is None:
-                    continue
-
                 fcurve_frames = get_fcurve_anim_frames(fcurve)
                 if fcurve_frames is not None:
-                    frames.extend(fcurve_frames)
-
-            frames = sorted(list(set(frames)))
+                    frames.update(fcurve_frames)
 
             if not frames:
                 continue
 
             is_animated = True
 
-            values = []
-            for frame in frames:
-                vec_comps = []
-
-                for ii, fcurve in enumerate(fcurves):
-                    if fcurve is None:
-                        vec_comps.append(getattr(anim_ref.default, vec_data_settings['attr'][ii]))
-                    else:
-                        vec_comps.append(fcurve.evaluate(frame))
-
-                values.append(vec_data_settings['convert'](vec_comps))
+            frames = sorted(frames)
+            # components without an fcurve keep their current value
+            values = fcurves_evaluate(fcurves, frames, tuple(getattr(self.bl, field))).tolist()
+            values = [vec_data_settings['convert'](vec_comps) for vec_comps in values]
 
             self.exporter.action_to_anim_data[action][anim_data_tag][int(head.hex_id, 16)] = (frames, values)
 
@@ -951,6 +1091,7 @@ class Exporter():
         self.exported_anims = []
         self.action_frame_range = {}
         self.action_to_anim_data = {}
+        self.action_to_fcurves = {}  # action: {(data path, array index): fcurve}
         self.action_to_sdmb_user = {}
         self.action_abs_pose_matrices = {}
         self.action_to_stc = {}
@@ -1044,7 +1185,8 @@ class Exporter():
                 for volume in attachment.volumes:
                     self.attachment_bones.append(attachment_point_bone)
 
-        self.ob_to_region_index = []
+        self.ob_to_region_index = {}  # mesh object: index of its first region
+        region_count = 0
 
         for mesh_ob in valid_collections['regions']:
             valid_mesh_batches = 0
@@ -1058,8 +1200,9 @@ class Exporter():
                 if group_bone:
                     self.skinned_bones.append(group_bone)
 
-            for ii in range(valid_mesh_batches):
-                self.ob_to_region_index.append(mesh_ob)
+            if valid_mesh_batches:
+                self.ob_to_region_index[mesh_ob] = region_count
+                region_count += valid_mesh_batches
 
         # TODO exclude materials if their type cannot be exported in model version
         # TODO warning if layers have rtt channel in non-standard material
@@ -1104,13 +1247,11 @@ class Exporter():
 
         self.depsgraph = bpy.context.evaluated_depsgraph_get()
 
-        self.bmesh_objects = []
+        self.mesh_arrays = {}  # object: MeshArrays, evaluated with self.depsgraph
+
         total_verts = 0
         for ob in valid_collections['regions']:
-            bm = bmesh.new(use_operators=True)
-            bm.from_object(ob, self.depsgraph)
-            total_verts += len(bm.verts)
-            self.bmesh_objects.append(bm)
+            total_verts += len(self.mesh_arrays_get(ob).co)
 
         if total_verts > 65536:
             self.err_strings.append(f'Overall vertex count ({total_verts}) exceeds the M3 format limit of 65536')
@@ -1246,6 +1387,9 @@ class Exporter():
         if not len(self.action_to_stc):
             return
 
+        # sections are placed relative to the sequence sections, all at once after they are created
+        layout = io_m3.M3SectionLayout(self.m3)
+
         for action, stc_list in self.action_to_stc.items():
 
             # do not calculate bounds if action which has no bone animation data, or there is no mesh data in general
@@ -1254,38 +1398,25 @@ class Exporter():
                 bnds_data = self.action_to_anim_data[action]['SDMB'][BNDS_ANIM_ID]
 
                 frame_list = list(self.action_abs_pose_matrices[action].keys())
-                init_frame = frame_list.pop(0)
-
-                prev_min, prev_max = bounding_vectors_from_bones(self.bone_bound_vecs, self.action_abs_pose_matrices[action][init_frame])
+                frame_mins, frame_maxs = bounding_arrays_from_bones(self.bone_bound_vecs, self.action_abs_pose_matrices[action].values())
 
                 if self.bl_op.use_only_max_bounds:
-                    if not frame_list:
-                        continue
-
-                    for frame in frame_list[1:]:
-                        bnds_min, bnds_max = bounding_vectors_from_bones(self.bone_bound_vecs, self.action_abs_pose_matrices[action][frame])
-
-                        for ii in range(3):
-                            prev_min[ii] = min(prev_min[ii], bnds_min[ii])
-
-                        for ii in range(3):
-                            prev_max[ii] = max(prev_max[ii], bnds_max[ii])
-
-                    bnds_data[0].append(init_frame)
-                    bnds_data[1].append(to_m3_bnds((prev_min, prev_max)))
+                    bnds_min, bnds_max = frame_mins.min(axis=0), frame_maxs.max(axis=0)
+                    bnds_data[0].append(frame_list[0])
+                    bnds_data[1].append(to_m3_bnds((mathutils.Vector(bnds_min.tolist()), mathutils.Vector(bnds_max.tolist()))))
 
                 else:
-                    bnds_data[0].append(init_frame)
-                    bnds_data[1].append(to_m3_bnds((prev_min, prev_max)))
+                    prev_min, prev_max = frame_mins[0], frame_maxs[0]
+                    bnds_data[0].append(frame_list[0])
+                    bnds_data[1].append(to_m3_bnds((mathutils.Vector(prev_min.tolist()), mathutils.Vector(prev_max.tolist()))))
 
-                    for frame in frame_list[0::3]:
-                        bnds_min, bnds_max = bounding_vectors_from_bones(self.bone_bound_vecs, self.action_abs_pose_matrices[action][frame])
-                        if (prev_min - bnds_min).length >= 0.03 or (prev_max - bnds_max).length >= 0.03:
+                    for frame, bnds_min, bnds_max in zip(frame_list[1:], frame_mins[1:], frame_maxs[1:]):
+                        if np.linalg.norm(prev_min - bnds_min) >= 0.03 or np.linalg.norm(prev_max - bnds_max) >= 0.03:
                             bnds_data[0].append(frame)
-                            bnds_data[1].append(to_m3_bnds((bnds_min, bnds_max)))
+                            bnds_data[1].append(to_m3_bnds((mathutils.Vector(bnds_min.tolist()), mathutils.Vector(bnds_max.tolist()))))
                             prev_min, prev_max = bnds_min, bnds_max
 
-            section_pos = self.m3.index(self.stc_to_name_section[stc_list[-1]])  # initially position behind name
+            cursor = layout.cursor_before(self.stc_to_name_section[stc_list[-1]])
 
             for stc in stc_list:
 
@@ -1316,13 +1447,13 @@ class Exporter():
                     evnt_name_sections.append(evnt_name_section)
                     evnt.matrix = to_m3_matrix(mathutils.Matrix(((1, 0, 0, 0), (0, 1, 0, 0), (0, 0, 1, 0), (0, 0, 0, 1))))
 
-                ids_section = self.m3.section_for_reference(stc, 'anim_ids', pos=section_pos)
+                ids_section = self.m3.section_for_reference(stc, 'anim_ids', pos=None)
+                cursor.insert(ids_section)
                 ids_sections.append(ids_section)
-                section_pos += 1
                 stc_ids_section[stc] = ids_section
-                refs_section = self.m3.section_for_reference(stc, 'anim_refs', pos=section_pos)
-                section_pos += 1
-                section_pos += 1  # hop over sts name section
+                refs_section = self.m3.section_for_reference(stc, 'anim_refs', pos=None)
+                cursor.insert(refs_section)
+                cursor.skip()  # hop over sts name section
 
                 anim_fend = float('-inf')
 
@@ -1344,8 +1475,8 @@ class Exporter():
                     action_data = self.action_to_anim_data[action][section_data_name]
                     attr_name = section_data_name.lower()
 
-                    data_section = self.m3.section_for_reference(stc, attr_name, pos=section_pos)
-                    section_pos += 1
+                    data_section = self.m3.section_for_reference(stc, attr_name, pos=None)
+                    cursor.insert(data_section)
 
                     for ii, id_num in enumerate(action_data):
                         data_head = data_section.content_add()
@@ -1355,30 +1486,31 @@ class Exporter():
 
                         data_head.fend = to_m3_ms(anim_fend)
 
-                        frames_section = self.m3.section_for_reference(data_head, 'frames', pos=section_pos)
+                        frames_section = self.m3.section_for_reference(data_head, 'frames', pos=None)
                         frames_section.content_add(*(to_m3_ms(frame) for frame in action_data[id_num][0]))
-                        section_pos += 1
+                        cursor.insert(frames_section)
 
-                        values_section = self.m3.section_for_reference(data_head, 'keys', pos=section_pos, version=evnt_version if section_data_name == 'SDEV' else 0)
+                        values_section = self.m3.section_for_reference(data_head, 'keys', pos=None, version=evnt_version if section_data_name == 'SDEV' else 0)
                         values_section.content_add(*action_data[id_num][1])
-                        section_pos += 1
+                        cursor.insert(values_section)
 
                         if section_data_name == 'SDEV':
                             data_head.flags = 1
 
                             for evnt_name_section in evnt_name_sections:
-                                self.m3.insert(section_pos, evnt_name_section)
-                                section_pos += 1
+                                cursor.insert(evnt_name_section)
 
-        section_pos = self.m3.index(self.stg_last_indice_section) + 1
-        sts_section = self.m3.section_for_reference(model, 'sts', pos=section_pos)
-        section_pos += 1
+        cursor = layout.cursor_after(self.stg_last_indice_section)
+        sts_section = self.m3.section_for_reference(model, 'sts', pos=None)
+        cursor.insert(sts_section)
         for action, stc_list in self.action_to_stc.items():
             for stc in stc_list:
                 sts = sts_section.content_add()
-                sts_ids_section = self.m3.section_for_reference(sts, 'anim_ids', pos=section_pos)
+                sts_ids_section = self.m3.section_for_reference(sts, 'anim_ids', pos=None)
                 sts_ids_section.content = stc_ids_section[stc].content
-                section_pos += 1
+                cursor.insert(sts_ids_section)
+
+        layout.apply()
 
     def create_bones(self, model, bones, sequences):
         if not bones:
@@ -1456,6 +1588,9 @@ class Exporter():
         if not (self.bl_op.output_anims or self.is_m3a):
             return
 
+        # without constraints, drivers or nla influence, local bone matrices follow from the action alone
+        use_depsgraph = pose_needs_depsgraph(self.ob)
+
         for anim_group in sequences:
             for anim in anim_group.animations:
                 if anim.action is None or anim.action in calc_actions:
@@ -1466,109 +1601,56 @@ class Exporter():
                 # maximum optimization would keep calls to ob_anim_data_set and frame_set to an absolute minimum
                 ob_anim_data_set(self.scene, self.ob, anim.action)
 
-                # jog animation frame so that complicated pose calculations are completed before proceeding
-                # TODO make an export option to step through a given number of previous frames to allow completion of timed calculations (ie wigglebone)
-                self.scene.frame_set(0)
-
                 frames_range = range(self.action_frame_range[anim.action][0], self.action_frame_range[anim.action][1] + 1)
                 frames = list(frames_range)
 
-                bone_to_pose_matrices = {bone: [] for bone in bones}
                 frame_to_bone_abs_pose_matrix = {frame: {} for frame in frames}
                 self.action_abs_pose_matrices[anim.action] = frame_to_bone_abs_pose_matrix
+                frame_start = self.action_frame_range[anim.action][0]
 
-                seq = list(range(4))
-
-                for frame in frames:
-                    self.scene.frame_set(frame)
+                # bone animation of unchanged actions is reused from the previous export, unless poses depend on the depsgraph
+                cache_key = ('ACTION', self.ob.name, anim.action.name)
+                fingerprint = None
+                if self.bl_op.use_cache and not use_depsgraph:
+                    fingerprint = self.action_fingerprint_get(anim.action, bones, frames, m3_bone_defaults, bone_to_m3_bone)
+                bone_anims = self.cache_get(cache_key, fingerprint)
 
-                    for pb in bones:
-                        pose_matrix = self.ob.convert_space(pose_bone=pb, matrix=pb.matrix, from_space='POSE', to_space='LOCAL')
-                        for ii in seq:  # fixes edge case where numbers ~ -0 should be interpreted as 0
-                            for jj in seq:
-                                if abs(pose_matrix[ii][jj]) < 0.00001:
-                                    pose_matrix[ii][jj] = 0
-                        bone_to_pose_matrices[pb].append(pose_matrix)
+                if bone_anims is None:
+                    bone_anims = self.get_bone_anims(anim.action, bones, frames, use_depsgraph, m3_bone_defaults, bone_to_m3_bone)
+                    self.cache_set(cache_key, fingerprint, bone_anims)
 
-                bone_m3_pose_matrices = {bone: [] for bone in bones}
+                bone_m3_pose_matrices = {}
 
                 for pose_bone in bones:
-                    data_bone = self.ob.data.bones.get(pose_bone.name)
                     m3_bone = bone_to_m3_bone[pose_bone]
-                    left_correction_matrix, right_correction_matrix = self.bone_to_correction_matrices[pose_bone]
-
-                    anim_locs = []
-                    anim_rots = []
-                    anim_scls = []
-
-                    loc_fcurves = [anim.action.fcurves.find(pose_bone.path_from_id('location'), index=ii) for ii in range(3)]
-                    loc_keyframes = []
-                    for ii, fcurve in enumerate(loc_fcurves):
-                        if fcurve:
-                            fcurve.keyframe_points.foreach_get('co', coords := [0] * (len(fcurve.keyframe_points) * 2))
-                            loc_keyframes.extend(coords[0::1])
-                    loc_keyframes = set(loc_keyframes)
-
-                    rot_fcurves = [anim.action.fcurves.find(pose_bone.path_from_id('rotation_quaternion'), index=ii) for ii in range(4)]
-                    rot_keyframes = []
-                    for ii, fcurve in enumerate(rot_fcurves):
-                        if fcurve:
-                            fcurve.keyframe_points.foreach_get('co', coords := [0] * (len(fcurve.keyframe_points) * 2))
-                            rot_keyframes.extend(coords[0::1])
-                    rot_keyframes = set(rot_keyframes)
-
-                    scl_fcurves = [anim.action.fcurves.find(pose_bone.path_from_id('scale'), index=ii) for ii in range(3)]
-                    scl_keyframes = []
-                    for ii, fcurve in enumerate(scl_fcurves):
-                        if fcurve:
-                            fcurve.keyframe_points.foreach_get('co', coords := [0] * (len(fcurve.keyframe_points) * 2))
-                            scl_keyframes.extend(coords[0::1])
-                    scl_keyframes = set(scl_keyframes)
-
-                    frame_start = self.action_frame_range[anim.action][0]
-
-                    for pose_matrix in bone_to_pose_matrices[pose_bone]:
-                        m3_pose_matrix = left_correction_matrix @ pose_matrix @ right_correction_matrix
-                        # storing these and operating on them later if boundings are needed
-                        bone_m3_pose_matrices[pose_bone].append(m3_pose_matrix)
-                        m3_pose = m3_pose_matrix.decompose()
-                        anim_locs.append(m3_pose[0])
-                        anim_rots.append(m3_pose[1])
-                        anim_scls.append(m3_pose[2])
-
-                    if vec_list_contains_not_only(anim_locs, m3_bone_defaults[m3_bone][0]):
-                        keys, values = simplify_anim_data_with_interp(frames, loc_keyframes, anim_locs, vec_interp, vec_equal)
-                        self.action_to_anim_data[anim.action]['SD3V'][m3_bone.location.header.id] = (keys, [to_m3_vec3(val) for val in values])
+                    m3_pose_matrices, loc_data, rot_data, scl_data, batching_data = bone_anims[pose_bone.name]
+                    bone_m3_pose_matrices[pose_bone] = m3_pose_matrices
+
+                    if loc_data:
+                        self.action_to_anim_data[anim.action]['SD3V'][m3_bone.location.header.id] = (loc_data[0], [to_m3_vec3(val) for val in loc_data[1]])
                         self.action_to_sdmb_user[anim.action] = not anim.concurrent
                         m3_bone.bit_set('flags', 'animated', True)
 
-                    if quat_list_contains_not_only(anim_rots, m3_bone_defaults[m3_bone][1]):
-                        quats_compatibility(anim_rots)
-                        keys, values = simplify_anim_data_with_interp(frames, rot_keyframes, anim_rots, quat_interp, quat_equal)
-                        self.action_to_anim_data[anim.action]['SD4Q'][m3_bone.rotation.header.id] = (keys, [to_m3_quat(val) for val in values])
+                    if rot_data:
+                        self.action_to_anim_data[anim.action]['SD4Q'][m3_bone.rotation.header.id] = (rot_data[0], [to_m3_quat(val) for val in rot_data[1]])
                         self.action_to_sdmb_user[anim.action] = not anim.concurrent
                         m3_bone.bit_set('flags', 'animated', True)
 
-                    if vec_list_contains_not_only(anim_scls, m3_bone_defaults[m3_bone][2]):
-                        keys, values = simplify_anim_data_with_interp(frames, scl_keyframes, anim_scls, vec_interp, vec_equal)
-                        self.action_to_anim_data[anim.action]['SD3V'][m3_bone.scale.header.id] = (keys, [to_m3_vec3(val) for val in values])
+                    if scl_data:
+                        self.action_to_anim_data[anim.action]['SD3V'][m3_bone.scale.header.id] = (scl_data[0], [to_m3_vec3(val) for val in scl_data[1]])
                         self.action_to_sdmb_user[anim.action] = not anim.concurrent
                         m3_bone.bit_set('flags', 'animated', True)
 
-                    # export animated batching property
-                    m3_batching_fcurve = anim.action.fcurves.find(pose_bone.path_from_id('m3_batching'))
-                    m3_batching_frames = get_fcurve_anim_frames(m3_batching_fcurve)
-
-                    if m3_batching_frames:
+                    if batching_data:
                         m3_bone.bit_set('flags', 'batch1', True)
                         m3_bone.bit_set('flags', 'batch2', True)
-                        m3_batching_values = [int(m3_batching_fcurve.evaluate(frame)) for frame in m3_batching_frames]
-                        self.action_to_anim_data[anim.action]['SDFG'][m3_bone.batching.header.id] = (m3_batching_frames, m3_batching_values)
+                        self.action_to_anim_data[anim.action]['SDFG'][m3_bone.batching.header.id] = batching_data
 
                 # calculate absolute pose matrices only if needed for boundings
                 if self.action_to_sdmb_user[anim.action]:
                     for bone in bones:
-                        for jj, m3_pose_matrix in enumerate(bone_m3_pose_matrices[bone]):
+                        for jj, m3_pose_matrix in enumerate(bone_m3_pose_matrices[bone].tolist()):
+                            m3_pose_matrix = mathutils.Matrix(m3_pose_matrix)
 
                             if bone.parent is not None:
                                 parent_abs_pose_matrix = frame_to_bone_abs_pose_matrix[jj + frame_start][bone.parent]
@@ -1582,6 +1664,127 @@ class Exporter():
         ob_anim_data_set(self.scene, self.ob, None)
         self.scene.frame_set(0)
 
+    def get_bone_anims(self, action, bones, frames, use_depsgraph, m3_bone_defaults, bone_to_m3_bone):
+        '''Pose matrices and simplified animation keys of each bone in the action, by bone name'''
+        bone_to_pose_matrices = {bone: [] for bone in bones}
+        action_fcurves = self.action_fcurves_get(action)
+        seq = list(range(4))
+
+        if use_depsgraph:
+            # jog animation frame so that complicated pose calculations are completed before proceeding
+            # TODO make an export option to step through a given number of previous frames to allow completion of timed calculations (ie wigglebone)
+            self.scene.frame_set(0)
+
+            for frame in frames:
+                self.scene.frame_set(frame)
+
+                for pb in bones:
+                    pose_matrix = self.ob.convert_space(pose_bone=pb, matrix=pb.matrix, from_space='POSE', to_space='LOCAL')
+                    bone_to_pose_matrices[pb].append(pose_matrix)
+        else:
+            for pb in bones:
+                bone_to_pose_matrices[pb] = pose_bone_basis_matrices(pb, action_fcurves, frames)
+
+        for pose_matrices in bone_to_pose_matrices.values():
+            for pose_matrix in pose_matrices:
+                for ii in seq:  # fixes edge case where numbers ~ -0 should be interpreted as 0
+                    for jj in seq:
+                        if abs(pose_matrix[ii][jj]) < 0.00001:
+                            pose_matrix[ii][jj] = 0
+
+        bone_anims = {}
+
+        for pose_bone in bones:
+            m3_bone = bone_to_m3_bone[pose_bone]
+            left_correction_matrix, right_correction_matrix = self.bone_to_correction_matrices[pose_bone]
+
+            anim_locs = []
+            anim_rots = []
+            anim_scls = []
+
+            loc_keyframes = set()
+            for ii in range(3):
+                fcurve = action_fcurves.get((pose_bone.path_from_id('location'), ii))
+                if fcurve:
+                    loc_keyframes.update(fcurve_key_frames(fcurve).tolist())
+
+            rot_keyframes = set()
+            for ii in range(4):
+                fcurve = action_fcurves.get((pose_bone.path_from_id('rotation_quaternion'), ii))
+                if fcurve:
+                    rot_keyframes.update(fcurve_key_frames(fcurve).tolist())
+
+            scl_keyframes = set()
+            for ii in range(3):
+                fcurve = action_fcurves.get((pose_bone.path_from_id('scale'), ii))
+                if fcurve:
+                    scl_keyframes.update(fcurve_key_frames(fcurve).tolist())
+
+            m3_pose_matrices = []
+
+            for pose_matrix in bone_to_pose_matrices[pose_bone]:
+                m3_pose_matrix = left_correction_matrix @ pose_matrix @ right_correction_matrix
+                # storing these and operating on them later if boundings are needed
+                m3_pose_matrices.append(m3_pose_matrix)
+                m3_pose = m3_pose_matrix.decompose()
+                anim_locs.append(m3_pose[0])
+                anim_rots.append(m3_pose[1])
+                anim_scls.append(m3_pose[2])
+
+            loc_data = rot_data = scl_data = batching_data = None
+
+            if vec_list_contains_not_only(anim_locs, m3_bone_defaults[m3_bone][0]):
+                loc_data = simplify_anim_data(frames, loc_keyframes, anim_locs)
+
+            if quat_list_contains_not_only(anim_rots, m3_bone_defaults[m3_bone][1]):
+                quats_compatibility(anim_rots)
+                rot_data = simplify_anim_data(frames, rot_keyframes, anim_rots, interpolation='SLERP')
+
+            if vec_list_contains_not_only(anim_scls, m3_bone_defaults[m3_bone][2]):
+                scl_data = simplify_anim_data(frames, scl_keyframes, anim_scls)
+
+            # export animated batching property
+            m3_batching_fcurve = action_fcurves.get((pose_bone.path_from_id('m3_batching'), 0))
+            m3_batching_frames = get_fcurve_anim_frames(m3_batching_fcurve)
+
+            if m3_batching_frames:
+                m3_batching_values = [int(m3_batching_fcurve.evaluate(frame)) for frame in m3_batching_frames]
+                batching_data = (m3_batching_frames, m3_batching_values)
+
+            bone_anims[pose_bone.name] = (np.array(m3_pose_matrices), loc_data, rot_data, scl_data, batching_data)
+
+        return bone_anims
+
+    def action_fingerprint_get(self, action, bones, frames, m3_bone_defaults, bone_to_m3_bone):
+        '''Digest of the action keyframes and of the bone state its bone animation is computed from, None if it cannot be fingerprinted'''
+        items = [frames]
+
+        for fcurve in action.fcurves:
+            if len(fcurve.modifiers):
+                return None
+
+            keyframe_points = fcurve.keyframe_points
+            items.append((fcurve.data_path, fcurve.array_index, fcurve.mute, fcurve.extrapolation))
+            for attr in ('interpolation', 'easing'):
+                values = np.empty(len(keyframe_points), dtype=np.int32)
+                keyframe_points.foreach_get(attr, values)
+                items.append(values)
+            for attr, size in (('co', 2), ('handle_left', 2), ('handle_right', 2), ('back', 1), ('amplitude', 1), ('period', 1)):
+                values = np.empty(len(keyframe_points) * size, dtype=np.float32)
+                keyframe_points.foreach_get(attr, values)
+                items.append(values)
+
+        for pose_bone in bones:
+            left_correction_matrix, right_correction_matrix = self.bone_to_correction_matrices[pose_bone]
+            items.append((
+                pose_bone.name, pose_bone.rotation_mode, tuple(pose_bone.location), tuple(pose_bone.rotation_quaternion),
+                tuple(pose_bone.rotation_euler), tuple(pose_bone.rotation_axis_angle), tuple(pose_bone.scale),
+                [tuple(row) for row in left_correction_matrix], [tuple(row) for row in right_correction_matrix],
+                [tuple(val) for val in m3_bone_defaults[bone_to_m3_bone[pose_bone]]],
+            ))
+
+        return fingerprint_get(*items)
+
     def create_division(self, model, mesh_objects, bones, regn_version):
         model.bit_set('flags', 'e_mdAllowLocalLightShadows', len(mesh_objects) > 0)
 
@@ -1658,10 +1861,11 @@ class Exporter():
         batch_section = self.m3.section_for_reference(div, 'batches', version=1, pos=None if self.is_m3a else -1)
 
         m3_vertices = []
+        m3_vertices_len = 0
         m3_faces = []
         m3_lookup = []
 
-        bone_bounding_points = {bone: [] for bone in bones}
+        bone_bounds = {}  # bone: (co min, co max) of the vertices weighted to it
 
         ob_to_regions = {}
         region_to_batch_bone = {}
@@ -1673,156 +1877,26 @@ class Exporter():
         if export_skin1:
             deformations_count += 2
 
-        m3_vert_id_eval = 'lambda m3v: (m3v.pos.x, m3v.pos.y, m3v.pos.z'
-        if export_normal:
-            m3_vert_id_eval += ', m3v.normal.x, m3v.normal.y, m3v.normal.z'
-        if deformations_count > 0:
-            m3_vert_id_eval += ', m3v.lookup0, m3v.lookup1, m3v.weight0, m3v.weight1'
-        if deformations_count > 2:
-            m3_vert_id_eval += ', m3v.lookup2, m3v.lookup3, m3v.weight2, m3v.weight3'
-        if export_col:
-            m3_vert_id_eval += ', m3v.col.r, m3v.col.g, m3v.col.b, m3v.col.a'
-        for ii in range(self.uv_count):
-            m3_vert_id_eval += f', m3v.uv{ii}.x, m3v.uv{ii}.y'
-        m3_vert_id_eval += ')'
-
-        # generating this lambda function to keep the conditional logic
-        # of which vert properties to get outside of the vert loop
-        m3_vert_id_get = eval(m3_vert_id_eval)
-
-        for ob_index, ob in enumerate(mesh_objects):
-            bm = bmesh.new(use_operators=True)
-            bm.from_object(ob, self.depsgraph)
-            bmesh.ops.transform(bm, matrix=ob.matrix_local, verts=bm.verts, use_shapekey=False)
-            bmesh.ops.triangulate(bm, faces=bm.faces)
-
-            layer_deform = bm.verts.layers.deform.verify()
-            layer_color = bm.loops.layers.color.get('m3color')
-            layer_alpha = bm.loops.layers.color.get('m3alpha')
-
-            layers_uv = bm.loops.layers.uv.values()
-
-            for ii in range(0, self.uv_count):
-                custom_uv_name = getattr(ob, f'm3_mesh_uv{ii}')
-                if custom_uv_name:
-                    for uv_layer in layers_uv:
-                        if custom_uv_name == uv_layer.name:
-                            layers_uv[ii] = uv_layer
-                            break
-
-            layers_uv = layers_uv[0:self.uv_count]
-            layer_tan = layers_uv[0]
-            vertex_lookups_used = 0
-
-            region_vertices = []
-            region_faces = []
-            region_lookup = []
-            group_to_lookup_ii = {}
-            for ii, group in enumerate(ob.vertex_groups):
-                if self.bone_name_indices.get(group.name) is not None:
-                    group_to_lookup_ii[ii] = len(region_lookup)
-                    region_lookup.append(self.bone_name_indices[group.name])
-
-                    if not deformations_count:
-                        break
-
-            region_vert_id_to_vert = {}
-            region_vert_count = 0
-
-            no_deform_verts = 0
-
-            for face in bm.faces:
-                loops = face.loops
-
-                c1, c2, c3 = (L.vert.co for L in loops)
-                u1, u2, u3 = (L[layer_tan].uv[0] for L in loops)
-                v1, v2, v3 = (L[layer_tan].uv[1] for L in loops)
+        vertex_dtype = struct_dtype_get(m3_vertex_desc)
 
-                d = (v2 - v1) * (u3 - u1) - (u2 - u1) * (v3 - v1)
-                try:
-                    tan = (((v3 - v1) * (c2 - c1) - (v2 - v1) * (c3 - c1)) / -d).normalized()
-                except ZeroDivisionError:
-                    tan = mathutils.Vector((0, 0, 0))
-
-                for loop in loops:
-                    co = loop.vert.co
-                    m3_vert = m3_vertex_desc.instance()
-                    m3_vert.pos = to_m3_vec3(co)
-
-                    # only count groups which have a lookup match, sort by weight and then limit to a length of 4
-                    deformations = []
-                    for deformation in loop.vert[layer_deform].items():
-                        lookup_ii = group_to_lookup_ii.get(deformation[0])
-                        if lookup_ii is not None and deformation[1]:
-                            deformations.append([lookup_ii, deformation[1]])
-                            bone_bounding_points[bones[region_lookup[lookup_ii]]].append(co.copy())
-
-                    if deformations_count:
-
-                        deformations.sort(key=lambda x: x[1])
-                        deformations = deformations[0:min(deformations_count, len(deformations))]
-
-                        if not len(deformations):
-                            no_deform_verts += 1
-
-                        # normalize the weights
-                        sum_weight = 0
-                        for index, weight in deformations:
-                            sum_weight += weight
-
-                        remaining_weight = 255
-                        for ii in range(len(deformations)):
-                            lookup = deformations[ii][0]
-                            weight = min(remaining_weight, round(deformations[ii][1] / sum_weight * 255))
-                            remaining_weight = max(0, remaining_weight - weight)
-                            if weight > 0:
-                                setattr(m3_vert, 'lookup' + str(ii), lookup)
-                                setattr(m3_vert, 'weight' + str(ii), weight)
-
-                        # sometimes there is 1 remaining weight left due to rounding errors
-                        # so we just add it onto the first lookup to prevent model glitches
-                        setattr(m3_vert, 'weight0', m3_vert.weight0 + remaining_weight)
-
-                    for ii in range(self.uv_count):
-                        uv_layer = layers_uv[ii] if ii < len(layers_uv) else None
-                        if uv_layer:
-                            uv = loop[uv_layer].uv
-                            setattr(m3_vert, 'uv' + str(ii), to_m3_uv(uv))
-                            # setattr(m3_vert, 'fuv' + str(ii), to_m3_vec2((uv[0] / 16, 1 - uv[1] / 16)))
-                        else:
-                            setattr(m3_vert, 'uv' + str(ii), to_m3_uv((0, 0)))
-                            # setattr(m3_vert, 'fuv' + str(ii), to_m3_vec2((0.0, 0.0)))
-
-                    if export_col:
-                        try:
-                            m3_vert.col = to_m3_color((*loop[layer_color][0:3], sum(loop[layer_alpha][0:3]) / 3))
-                        except AttributeError:
-                            m3_vert.col = to_m3_color((1, 1, 1, 1))
-
-                    m3_vert.normal = to_m3_vec3_uint8(loop.vert.normal)
-                    m3_vert.tan = to_m3_vec3_uint8(tan)
-                    m3_vert.sign = 0 if d < 0 else 255
-
-                    id_tuple = m3_vert_id_get(m3_vert)
-                    id_index = region_vert_id_to_vert.get(id_tuple)
-                    if id_index is None:
-                        id_index = region_vert_count
-                        region_vert_id_to_vert[id_tuple] = id_index
-
-                        vertex_lookups_used = max(vertex_lookups_used, len(deformations))
-
-                        m3_vertex_desc.instance_validate(m3_vert, 'vertex')
-                        region_vertices.append(m3_vert)
-                        region_vert_count += 1
+        for ob in mesh_objects:
+            skipped, region_lookup, region_bone_bounds, region_vertices, region_faces, vertex_lookups_used = self.get_region_data(
+                ob, bones, deformations_count, vertex_dtype, export_col, export_normal
+            )
 
-                    region_faces.append(id_index)
+            for lookup_ii, co_min, co_max in region_bone_bounds:
+                bone = bones[region_lookup[lookup_ii]]
+                if bone in bone_bounds:
+                    co_min, co_max = np.minimum(co_min, bone_bounds[bone][0]), np.maximum(co_max, bone_bounds[bone][1])
+                bone_bounds[bone] = (co_min, co_max)
 
-            if no_deform_verts:
+            if skipped:
                 self.warn_strings.append(f'{str(ob)} has at least one vertex with no weight given to a valid bone and will not be exported')
                 continue
 
-            first_vertex_index = len(m3_vertices)
-            m3_vertices.extend(region_vertices)
+            first_vertex_index = m3_vertices_len
+            m3_vertices.append(region_vertices)
+            m3_vertices_len += len(region_vertices)
 
             first_lookup_index = len(m3_lookup)
             m3_lookup.extend(region_lookup)
@@ -1908,12 +1982,8 @@ class Exporter():
         self.bone_bound_vecs = {}
 
         for bone in bones:
-            if not bone_bounding_points[bone]:
-                continue
-            x_cos, y_cos, z_cos = zip(*bone_bounding_points[bone])
-            vec_min = mathutils.Vector((min(x_cos), min(y_cos), min(z_cos)))
-            vec_max = mathutils.Vector((max(x_cos), max(y_cos), max(z_cos)))
-            self.bone_bound_vecs[bone] = (vec_min, vec_max)
+            if bone in bone_bounds:
+                self.bone_bound_vecs[bone] = bone_bounds[bone]
 
         self.region_section = region_section
 
@@ -1921,11 +1991,173 @@ class Exporter():
         msec = msec_section.content_add()
         msec.bounding = self.init_anim_ref_bnds(bounding_vectors_from_bones(self.bone_bound_vecs, self.bone_to_abs_pose_matrix))
 
-        vertex_section.content_add(*list(m3_vertex_desc.instances_to_bytearray(m3_vertices)))
+        if m3_vertices:
+            vertex_section.content += list(np.concatenate(m3_vertices).tobytes())
         face_section.content_add(*m3_faces)
         bone_lookup_section = self.m3.section_for_reference(model, 'bone_lookup')
         bone_lookup_section.content_add(*m3_lookup)
 
+    def get_region_data(self, ob, bones, deformations_count, vertex_dtype, export_col, export_normal):
+        '''Vertices, faces, bone lookup and bone bounds of the region of a mesh object, or only the lookup and bounds if it cannot be exported'''
+        mesh_arrays = self.mesh_arrays_get(ob)
+        co = mesh_arrays.co_transformed(ob.matrix_local)
+        co += 0.0  # negative zeros would otherwise keep equal vertices apart
+        normals = mesh_arrays.normals
+        tri_loops = mesh_arrays.tri_loops
+        tri_verts = mesh_arrays.tri_verts
+
+        layers_uv = mesh_arrays.uv_layer_names + [None] * self.uv_count
+
+        for ii in range(0, self.uv_count):
+            custom_uv_name = getattr(ob, f'm3_mesh_uv{ii}')
+            if custom_uv_name in mesh_arrays.loop_uvs:
+                layers_uv[ii] = custom_uv_name
+
+        # uvs of missing layers are exported as zero
+        loop_uvs = []
+        for uv_layer in layers_uv[0:max(1, self.uv_count)]:
+            if uv_layer:
+                loop_uvs.append(mesh_arrays.loop_uvs[uv_layer][tri_loops])
+            else:
+                loop_uvs.append(np.zeros((len(tri_loops), 2), dtype=np.float32))
+
+        region_lookup = []
+        group_to_lookup_ii = {}
+        for ii, group in enumerate(ob.vertex_groups):
+            if self.bone_name_indices.get(group.name) is not None:
+                group_to_lookup_ii[ii] = len(region_lookup)
+                region_lookup.append(self.bone_name_indices[group.name])
+
+                if not deformations_count:
+                    break
+
+        # regions of unchanged meshes are reused from the previous export
+        cache_key = ('REGION', ob.name)
+        fingerprint = None
+        if self.bl_op.use_cache:
+            fingerprint = fingerprint_get(
+                mesh_arrays.co, mesh_arrays.normals, tri_loops, tri_verts, mesh_arrays.deform_verts, mesh_arrays.deform_groups, mesh_arrays.deform_weights,
+                *loop_uvs, *(mesh_arrays.loop_colors.get(name) for name in ('m3color', 'm3alpha') if export_col),
+                [tuple(row) for row in ob.matrix_local], sorted(group_to_lookup_ii.items()), region_lookup, deformations_count, self.uv_count, export_col, export_normal,
+                vertex_dtype.descr,
+            )
+
+        region_data = self.cache_get(cache_key, fingerprint)
+        if region_data is not None:
+            return region_data
+
+        # only count groups which have a lookup match
+        group_lookups = np.full(len(ob.vertex_groups) + 1, -1, dtype=np.int32)
+        for group_ii, lookup_ii in group_to_lookup_ii.items():
+            group_lookups[group_ii] = lookup_ii
+
+        deform_lookups = group_lookups[np.minimum(mesh_arrays.deform_groups, len(ob.vertex_groups))]
+        deform_mask = (deform_lookups != -1) & (mesh_arrays.deform_weights != 0)
+        deform_verts = mesh_arrays.deform_verts[deform_mask]
+        deform_lookups = deform_lookups[deform_mask]
+        deform_weights = mesh_arrays.deform_weights[deform_mask]
+
+        used_verts = np.zeros(len(co), dtype=bool)
+        used_verts[tri_verts] = True
+        used_deforms = used_verts[deform_verts]
+
+        region_bone_bounds = []
+        for lookup_ii in np.unique(deform_lookups[used_deforms]).tolist():
+            bone_cos = co[deform_verts[used_deforms & (deform_lookups == lookup_ii)]]
+            region_bone_bounds.append((lookup_ii, bone_cos.min(axis=0), bone_cos.max(axis=0)))
+
+        vert_deform_counts = np.minimum(np.bincount(deform_verts, minlength=len(co)), deformations_count)
+
+        if deformations_count and not vert_deform_counts[tri_verts].all():
+            region_data = (True, region_lookup, region_bone_bounds, None, None, None)
+            self.cache_set(cache_key, fingerprint, region_data)
+            return region_data
+
+        m3_verts = np.zeros(len(tri_loops), dtype=vertex_dtype)
+        m3_verts['pos']['x'], m3_verts['pos']['y'], m3_verts['pos']['z'] = co[tri_verts].T
+
+        if deformations_count:
+            # sort by weight and then limit to a length of 4
+            order = np.lexsort((-deform_weights, deform_verts))
+            sorted_verts = deform_verts[order]
+            ranks = np.arange(len(order)) - np.searchsorted(sorted_verts, sorted_verts)
+            ranked = ranks < deformations_count
+
+            vert_lookups = np.zeros((len(co), deformations_count), dtype=np.int32)
+            vert_weights = np.zeros((len(co), deformations_count), dtype=np.float64)
+            vert_lookups[sorted_verts[ranked], ranks[ranked]] = deform_lookups[order][ranked]
+            vert_weights[sorted_verts[ranked], ranks[ranked]] = deform_weights[order][ranked]
+
+            # normalize the weights
+            sum_weights = vert_weights.sum(axis=1)
+            vert_weights = np.round(vert_weights / np.where(sum_weights == 0, 1.0, sum_weights)[:, None] * 255)
+
+            remaining_weights = np.full(len(co), 255.0)
+            for ii in range(deformations_count):
+                vert_weights[:, ii] = np.minimum(remaining_weights, vert_weights[:, ii])
+                remaining_weights = np.maximum(0, remaining_weights - vert_weights[:, ii])
+
+            vert_lookups[vert_weights == 0] = 0
+
+            # sometimes there is 1 remaining weight left due to rounding errors
+            # so we just add it onto the first lookup to prevent model glitches
+            vert_weights[:, 0] += remaining_weights
+
+            if vert_lookups.max(initial=0) > 255:
+                raise Exception(f'{str(ob)} has more than 256 vertex groups of valid bones with weights, which a region can not reference')
+
+            for ii in range(deformations_count):
+                m3_verts[f'lookup{ii}'] = vert_lookups[tri_verts, ii]
+                m3_verts[f'weight{ii}'] = vert_weights[tri_verts, ii]
+
+        for ii in range(self.uv_count):
+            uvs = loop_uvs[ii]
+            m3_verts[f'uv{ii}']['x'] = np.clip(np.round(uvs[:, 0] * 2048), INT16_MIN, INT16_MAX)
+            m3_verts[f'uv{ii}']['y'] = np.clip(np.round((-uvs[:, 1] + 1.0) * 2048), INT16_MIN, INT16_MAX)
+
+        if export_col:
+            colors = np.ones((len(tri_loops), 4), dtype=np.float32)
+            layer_color = mesh_arrays.loop_colors.get('m3color')
+            layer_alpha = mesh_arrays.loop_colors.get('m3alpha')
+
+            if layer_color is not None and layer_alpha is not None:
+                colors[:, 0:3] = layer_color[tri_loops, 0:3]
+                colors[:, 3] = layer_alpha[tri_loops, 0:3].mean(axis=1)
+
+            colors = np.round(colors * 255)
+            m3_verts['col']['r'], m3_verts['col']['g'], m3_verts['col']['b'], m3_verts['col']['a'] = colors.T
+
+        normals8 = np.round((normals[tri_verts] + 1) / 2 * 255)
+        m3_verts['normal']['x'], m3_verts['normal']['y'], m3_verts['normal']['z'] = normals8.T
+
+        tri_tans, tri_signs = tri_tangents_get(co[tri_verts].reshape(-1, 3, 3), loop_uvs[0].reshape(-1, 3, 2))
+        tans8 = np.round((np.repeat(tri_tans, 3, axis=0) + 1) / 2 * 255)
+        m3_verts['tan']['x'], m3_verts['tan']['y'], m3_verts['tan']['z'] = tans8.T
+        m3_verts['sign'] = np.repeat(tri_signs, 3)
+
+        # vertices are numbered in order of their first use, as identical vertices are merged.
+        # tangents are not part of the vertex identity, so the tangent of the first use is kept
+        vert_ids = m3_verts.copy()
+        vert_ids['tan'] = 0
+        vert_ids['sign'] = 0
+        if not export_normal:
+            vert_ids['normal'] = 0
+        vert_ids = vert_ids.view(np.dtype((np.void, vertex_dtype.itemsize)))
+        vert_ids_unique, vert_ids_first, vert_ids_inverse = np.unique(vert_ids, return_index=True, return_inverse=True)
+        vert_ids_order = np.argsort(vert_ids_first)
+        vert_ids_rank = np.empty_like(vert_ids_order)
+        vert_ids_rank[vert_ids_order] = np.arange(len(vert_ids_order))
+
+        region_vertices = m3_verts[vert_ids_first[vert_ids_order]]
+        region_faces = vert_ids_rank[vert_ids_inverse.ravel()].tolist()
+
+        vertex_lookups_used = int(vert_deform_counts[tri_verts].max(initial=0))
+
+        region_data = (False, region_lookup, region_bone_bounds, region_vertices, region_faces, vertex_lookups_used)
+        self.cache_set(cache_key, fingerprint, region_data)
+
+        return region_data
+
     def create_attachment_points(self, model, attachments):
         attachment_point_section = self.m3.section_for_reference(model, 'attachment_points', version=1)
 
@@ -2207,7 +2439,7 @@ class Exporter():
                     region_indices = set()
                     for mesh_pointer in system.emit_shape_meshes:
                         if mesh_pointer.bl_object in self.ob_to_region_index:
-                            region_indices.add(self.ob_to_region_index.index(mesh_pointer.bl_object))
+                            region_indices.add(self.ob_to_region_index[mesh_pointer.bl_object])
                     if len(region_indices):
                         region_indices_section = self.m3.section_for_reference(m3_system, 'emit_shape_regions')
                         region_indices_section.content_add(*region_indices)
@@ -2443,8 +2675,8 @@ class Exporter():
             mesh_ob = physics_cloth.mesh_object
             sim_ob = physics_cloth.simulator_object
 
-            regn_inf = self.region_section[self.ob_to_region_index.index(mesh_ob)]
-            regn_sim = self.region_section[self.ob_to_region_index.index(sim_ob)]
+            regn_inf = self.region_section[self.ob_to_region_index[mesh_ob]]
+            regn_sim = self.region_section[self.ob_to_region_index[sim_ob]]
 
             # set flags for regions used by the cloth behavior
             regn_inf.bit_set('flags', 'hidden', True)
@@ -2455,7 +2687,7 @@ class Exporter():
             regn_sim.bit_set('flags', 'cloth_simulated', True)
 
             m3_physics_cloth = physics_cloth_section.content_add()
-            m3_physics_cloth.simulation_region_index = self.ob_to_region_index.index(sim_ob)
+            m3_physics_cloth.simulation_region_index = self.ob_to_region_index[sim_ob]
 
             processor = M3OutputProcessor(self, physics_cloth, m3_physics_cloth)
             io_shared.io_cloth(processor)
@@ -2488,20 +2720,15 @@ class Exporter():
 
             influence_map_section = self.m3.section_for_reference(m3_physics_cloth, 'influence_map', version=0)
             m3_influence_map = influence_map_section.content_add()
-            m3_influence_map.influenced_region_index = self.ob_to_region_index.index(mesh_ob)
-            m3_influence_map.simulation_region_index = self.ob_to_region_index.index(sim_ob)
+            m3_influence_map.influenced_region_index = self.ob_to_region_index[mesh_ob]
+            m3_influence_map.simulation_region_index = self.ob_to_region_index[sim_ob]
 
             sim_group_names = [group.name for group in sim_ob.vertex_groups]
             sim_group_verts = {group.name: [] for group in sim_ob.vertex_groups}
 
-            sim_bm = bmesh.new()
-            sim_bm.from_object(sim_ob, self.depsgraph)
-
-            layer_deform = sim_bm.verts.layers.deform.get('m3lookup')
-            layer_clothsim = sim_bm.verts.layers.int.get('m3clothsim') or sim_bm.verts.layers.int.new('m3clothsim')
+            sim_arrays = self.mesh_arrays_get(sim_ob)
 
-            for vert in sim_bm.verts:
-                bone_weight_pairs = vert[layer_deform].items()
+            for vert_index, bone_weight_pairs in enumerate(sim_arrays.vert_group_pairs()):
                 vertex_bones = 0
                 vertex_weights = 0
                 # assume that weights are already normalized
@@ -2512,12 +2739,12 @@ class Exporter():
                         vertex_bones |= bone_index << (weighted * 8)
                         vertex_weights |= round(weight * 255) << (weighted * 8)
                         skin_bones.add(bone_index)
-                        sim_group_verts[sim_group_names[index]].append(vert)
+                        sim_group_verts[sim_group_names[index]].append(vert_index)
                         weighted += 1
                     if weighted >= 4:
                         break
 
-                vertex_simulated_list.append(vert[layer_clothsim])
+                vertex_simulated_list.append(sim_arrays.clothsim[vert_index].item())
                 vertex_bones_section.content_add(vertex_bones)
                 vertex_weights_section.content_add(vertex_weights)
 
@@ -2527,30 +2754,29 @@ class Exporter():
             simulation_vertex_lookups_section = self.m3.section_for_reference(m3_influence_map, 'simulation_vert_lookups')
             simulation_vertex_weights_section = self.m3.section_for_reference(m3_influence_map, 'simulation_vert_weights')
 
-            mesh_bm = bmesh.new()
-            mesh_bm.from_object(mesh_ob, self.depsgraph)
+            mesh_arrays = self.mesh_arrays_get(mesh_ob)
 
-            mesh_group_names = [group.name for group in mesh_ob.vertex_groups]
-            mesh_group_to_sim_group_verts = {ii: sim_group_verts[mesh_group_names[ii]] for ii in range(len(mesh_ob.vertex_groups))}
+            # nearest simulation vertices are looked up per group in a kd-tree of the vertices of that group
+            sim_group_kdtrees = {}
+            for group_name, group_sim_verts in sim_group_verts.items():
+                kd = mathutils.kdtree.KDTree(len(group_sim_verts))
+                for vert_index, co in zip(group_sim_verts, sim_arrays.co[group_sim_verts].tolist()):
+                    kd.insert(co, vert_index)
+                kd.balance()
+                sim_group_kdtrees[group_name] = kd
 
-            for vert in mesh_bm.verts:
-                layer_deform = mesh_bm.verts.layers.deform.get('m3lookup')
-                group_weight_pairs = vert[layer_deform].items()
+            mesh_group_names = [group.name for group in mesh_ob.vertex_groups]
+            mesh_group_to_sim_group_kdtree = {ii: sim_group_kdtrees[mesh_group_names[ii]] for ii in range(len(mesh_ob.vertex_groups))}
 
+            for vert_co, group_weight_pairs in zip(mesh_arrays.co.tolist(), mesh_arrays.vert_group_pairs()):
                 sim_verts = 0
                 sim_weights = 0
                 weighted = 0
-                # used_sim_verts = []
                 for index, weight in group_weight_pairs:
                     #  there should be always be sim verts. if not, some user error likely has occurred
                     if weight:
-                        distance_sim_verts = []
-                        for sim_vert in mesh_group_to_sim_group_verts[index]:
-                            # if sim_vert not in used_sim_verts:
-                            distance_sim_verts.append([(vert.co - sim_vert.co).length, sim_vert])
-                            # used_sim_verts.append(sim_vert)
-                        distance_sim_verts.sort()
-                        sim_verts |= distance_sim_verts[0][1].index << (weighted * 16)
+                        sim_co, sim_vert_index, sim_distance = mesh_group_to_sim_group_kdtree[index].find(vert_co)
+                        sim_verts |= sim_vert_index << (weighted * 16)
                         sim_weights |= round(weight * 255) << (weighted * 8)
                         weighted += 1
                     if weighted >= 4:
@@ -2717,18 +2943,40 @@ class Exporter():
             for vec_item in tmd.vectors:
                 tmd_vec_section.content_add(to_m3_vec3(vec_item.vector))
 
+    def cache_get(self, key, fingerprint):
+        if fingerprint is None:
+            return None
+        cached = export_cache.get(key)
+        if not cached or cached[0] != fingerprint:
+            return None
+        export_cache.move_to_end(key)
+        return cached[1]
+
+    def cache_set(self, key, fingerprint, data):
+        if fingerprint is not None:
+            export_cache[key] = (fingerprint, data)
+            export_cache.move_to_end(key)
+            while len(export_cache) > EXPORT_CACHE_SIZE:
+                export_cache.popitem(last=False)
+
+    def action_fcurves_get(self, action):
+        action_fcurves = self.action_to_fcurves.get(action)
+        if action_fcurves is None:
+            action_fcurves = self.action_to_fcurves[action] = {(fcurve.data_path, fcurve.array_index): fcurve for fcurve in action.fcurves}
+        return action_fcurves
+
+    def mesh_arrays_get(self, ob):
+        mesh_arrays = self.mesh_arrays.get(ob)
+        if mesh_arrays is None:
+            mesh_arrays = self.mesh_arrays[ob] = MeshArrays(ob, self.depsgraph)
+        return mesh_arrays
+
     def get_basic_volume_object(self, mesh_ob, m3):
         if mesh_ob.name not in self.mesh_to_basic_volume_sections.keys() or self.bl_op.section_reuse_mode == 'SINGLE':
-            bm = bmesh.new(use_operators=True)
-            bm.from_object(mesh_ob, self.depsgraph)
-            bmesh.ops.triangulate(bm, faces=bm.faces)
-
-            vert_data = [to_m3_vec3(vert.co) for vert in bm.verts]
-            face_data = []
+            mesh_arrays = self.mesh_arrays_get(mesh_ob)
 
-            for face in bm.faces:
-                for vert in face.verts:
-                    face_data.append(vert.index)
+            vert_data = [to_m3_vec3(co) for co in mesh_arrays.co.tolist()]
+            face_data = mesh_arrays.tri_verts.tolist()
 
             vert_section = self.m3.section_for_reference(m3, 'vertices')
             vert_section.content_add(*vert_data)
@@ -2742,22 +2990,18 @@ class Exporter():
 
     def get_physics_volume_object(self, mesh_ob, m3, version):
         if mesh_ob.name not in self.mesh_to_physics_volume_sections.keys() or self.bl_op.section_reuse_mode == 'SINGLE':
-            bm = bmesh.new(use_operators=True)
-            bm.from_object(mesh_ob, self.depsgraph)
+            mesh_arrays = self.mesh_arrays_get(mesh_ob)
 
-            vert_data = [to_m3_vec3(vert.co) for vert in bm.verts]
+            vert_data = [to_m3_vec3(co) for co in mesh_arrays.co.tolist()]
             plane_equation_data = []
 
             vert_section = self.m3.section_for_reference(m3, 'vertices')
             vert_section.content_add(*vert_data)
 
-            if int(version) == 1:
-                bmesh.ops.triangulate(bm, faces=bm.faces)
+            bm = None
 
-                face_data = []
-                for face in bm.faces:
-                    for vert in face.verts:
-                        face_data.append(vert.index)
+            if int(version) == 1:
+                face_data = mesh_arrays.tri_verts.tolist()
 
                 face_section = self.m3.section_for_reference(m3, 'face_data')
                 face_section.content_add(*face_data)
@@ -2765,7 +3009,10 @@ class Exporter():
             plane_equation_section = None
 
             if m3.shape == 4:
-                bmesh.ops.delete(bm, geom=bm.verts[:] + bm.edges[:] + bm.faces[:], context='EDGES_FACES')
+                bm = bmesh.new(use_operators=True)
+                for co in mesh_arrays.co.tolist():
+                    bm.verts.new(co)
+                bm.verts.index_update()
                 geom = bmesh.ops.convex_hull(bm, input=bm.verts[:], use_existing_faces=False)
                 bmesh.ops.delete(bm, geom=geom['geom_interior'], context='VERTS')
                 bmesh.ops.dissolve_limit(bm, angle_limit=0.05, use_dissolve_boundaries=False, verts=bm.verts, edges=bm.edges)
@@ -2789,18 +3036,28 @@ class Exporter():
                 polygon_data = []
                 polygon_medians = []
 
-                bm.verts.ensure_lookup_table()
-                bm.edges.ensure_lookup_table()
-                bm.faces.ensure_lookup_table()
-
-                for face in bm.faces:
+                if bm:
+                    bm.faces.index_update()
+                    poly_indices = [face.index for face in bm.faces]
+                    poly_verts = [[vert.index for vert in face.verts] for face in bm.faces]
+                    polygon_medians = [face.calc_center_bounds() for face in bm.faces]
+                else:
+                    poly_indices = range(len(mesh_arrays.poly_loop_starts))
+                    poly_verts = np.split(mesh_arrays.loop_verts, mesh_arrays.poly_loop_starts[1:])
+                    poly_verts = [verts.tolist() for verts in poly_verts]
+                    poly_cos = mesh_arrays.co[mesh_arrays.loop_verts]
+                    poly_mins = np.minimum.reduceat(poly_cos, mesh_arrays.poly_loop_starts) if len(poly_cos) else poly_cos
+                    poly_maxs = np.maximum.reduceat(poly_cos, mesh_arrays.poly_loop_starts) if len(poly_cos) else poly_cos
+                    polygon_medians = ((poly_mins + poly_maxs) / 2).tolist()
+
+                for poly_index, verts in zip(poly_indices, poly_verts):
                     polygon_data.append(loop_data_count)
-                    last_iter = len(face.loops) - 1
-                    for ii, loop in enumerate(face.loops):
+                    last_iter = len(verts) - 1
+                    for ii, vert_index in enumerate(verts):
                         m3_loop = loop_desc.instance()
                         m3_loop.unknown00 = 1
-                        m3_loop.vertex = loop.vert.index
-                        m3_loop.polygon = face.index
+                        m3_loop.vertex = vert_index
+                        m3_loop.polygon = poly_index
 
                         loop_data_count += 1
 
@@ -2811,9 +3068,6 @@ class Exporter():
 
                         loop_data.append(m3_loop)
 
-                    vec = face.calc_center_bounds()
-                    polygon_medians.append(vec)
-
                 loop_section = self.m3.section_for_reference(m3, 'loops')
                 loop_section.content_add(*loop_data)
                 polygon_section = self.m3.section_for_reference(m3, 'polygons')
@@ -2824,6 +3078,9 @@ class Exporter():
                 m3.polygons_count = len(polygon_section)
                 m3.loops_count = len(loop_section)
 
+            if bm:
+                bm.free()
+
             if int(version) == 1:
                 self.mesh_to_physics_volume_sections[mesh_ob.name] = [vert_section, face_data, plane_equation_section, None, None]
             else:
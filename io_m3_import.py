@@ -16,15 +16,22 @@
 #
 # ##### END GPL LICENSE BLOCK #####
 
+import json
+import functools
 import math
+import threading
+import time
 import traceback
 import bpy
 import bmesh
 import mathutils
+import numpy as np
 from . import io_m3
 from . import io_shared
 from . import shared
-from .m3_animations import set_default_value, ob_anim_data_set
+from .m3_animations import set_default_value, ob_anim_data_set, DefaultValueBatch
+from .m3_materials import m3_materials_prune
+from .m3_object_mesh import me_attribute_cloth_sim
 
 
 FRAME_RATE = 30
@@ -70,6 +77,18 @@ def to_bl_matrix(m3_matrix):
     ))
 
 
+def vectors_normalized(vectors):
+    lengths = np.linalg.norm(vectors, axis=1)
+    # zero length vectors are left as they are, as in Vector.normalized
+    return vectors / np.where(lengths == 0, 1.0, lengths)[:, None]
+
+
+def vectors_angle(vectors_a, vectors_b):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cosines = (vectors_a * vectors_b).sum(axis=1) / (np.linalg.norm(vectors_a, axis=1) * np.linalg.norm(vectors_b, axis=1))
+    return np.arccos(np.clip(cosines, -1.0, 1.0))
+
+
 class M3InputProcessor:
 
     def __init__(self, importer, bl, m3):
@@ -152,7 +171,7 @@ class M3InputProcessor:
     def anim_integer(self, field):
         anim_ref = getattr(self.m3, field)
         setattr(self.bl, field, anim_ref.default)
-        key_fcurves(self.importer.stc_id_data, self.bl, field, anim_ref.header, (anim_ref.default,))
+        key_fcurves(self.importer.stc_id_data, self.bl, field, anim_ref.header, (anim_ref.default,), self.importer.default_values, self.importer.key_tolerance)
 
     def anim_int16(self, field):
         self.anim_integer(field)
@@ -168,13 +187,13 @@ class M3InputProcessor:
             return
         anim_ref = getattr(self.m3, field)
         setattr(self.bl, field, anim_ref.default)
-        key_fcurves(self.importer.stc_id_data, self.bl, field, anim_ref.header, (anim_ref.default,))
+        key_fcurves(self.importer.stc_id_data, self.bl, field, anim_ref.header, (anim_ref.default,), self.importer.default_values, self.importer.key_tolerance)
 
     def anim_vec2(self, field):
         anim_ref = getattr(self.m3, field)
         default = to_bl_vec2(anim_ref.default)
         setattr(self.bl, field, default)
-        key_fcurves(self.importer.stc_id_data, self.bl, field, anim_ref.header, default)
+        key_fcurves(self.importer.stc_id_data, self.bl, field, anim_ref.header, default, self.importer.default_values, self.importer.key_tolerance)
 
     def anim_vec3(self, field, since_version=None):
         if (since_version is not None) and (self.version < since_version):
@@ -182,7 +201,7 @@ class M3InputProcessor:
         anim_ref = getattr(self.m3, field)
         default = to_bl_vec3(anim_ref.default)
         setattr(self.bl, field, default)
-        key_fcurves(self.importer.stc_id_data, self.bl, field, anim_ref.header, default)
+        key_fcurves(self.importer.stc_id_data, self.bl, field, anim_ref.header, default, self.importer.default_values, self.importer.key_tolerance)
 
     def anim_color(self, field, since_version=None):
         if (since_version is not None) and (self.version < since_version):
@@ -190,7 +209,7 @@ class M3InputProcessor:
         anim_ref = getattr(self.m3, field)
         default = to_bl_color(anim_ref.default)
         setattr(self.bl, field, default)
-        key_fcurves(self.importer.stc_id_data, self.bl, field, anim_ref.header, default)
+        key_fcurves(self.importer.stc_id_data, self.bl, field, anim_ref.header, default, self.importer.default_values, self.importer.key_tolerance)
 
 
 def m3_key_collect_evnt(key_frames, key_values):
@@ -259,13 +278,50 @@ def m3_key_collect_bnds(key_frames, key_values):
     pass  # handle these specially
 
 
+def m3_keys_reduce(ll, tolerance, interpolation='LINEAR'):
+    '''
+        Removes the keys of collected key lists which the remaining keys reproduce within tolerance.
+        All components are reduced together so that they keep sharing the same frames.
+        interpolation is one of CONSTANT, LINEAR or QUATERNION_LINEAR, for which the tolerance is an angle in radians.
+        '''
+    if not ll or len(ll[0]) < 6:
+        return ll
+
+    data = np.array(ll, dtype=np.float64).reshape(len(ll), -1, 2)
+    if interpolation == 'QUATERNION_LINEAR':
+        # blender blends the keys as written, so opposite signs of neighbouring keys would take the longer path
+        data[:, :, 1] = io_shared.quats_sign_aligned(data[:, :, 1].T).T
+
+    keep = io_shared.keys_reduce(data[0, :, 0], data[:, :, 1].T, tolerance, interpolation)
+
+    return tuple(data[ii, keep].ravel().tolist() for ii in range(len(ll)))
+
+
 m3_key_type_collection_method = [
     m3_key_collect_evnt, m3_key_collect_vec2, m3_key_collect_vec3, m3_key_collect_quat, m3_key_collect_colo, m3_key_collect_real, m3_key_collect_real,
     m3_key_collect_real, m3_key_collect_real, m3_key_collect_real, m3_key_collect_real, m3_key_collect_real, m3_key_collect_bnds,
 ]
 
 
-def key_fcurves(stc_dict, bl, field, header, default):
+# keyframe point attribute sequences are shared by fcurves of the same length, and only the recently used ones are kept
+@functools.lru_cache(maxsize=64, typed=True)
+def key_seq_get(value, length):
+    return (value,) * length
+
+
+def fcurve_keys_set(fcurve, co, interp):
+    points_len = len(co) // 2
+    key_sel_seq = key_seq_get(False, points_len)
+    keyframe_points = fcurve.keyframe_points
+    keyframe_points.add(points_len)
+    keyframe_points.foreach_set('co', co)
+    keyframe_points.foreach_set('interpolation', key_seq_get(interp, points_len))
+    keyframe_points.foreach_set('select_control_point', key_sel_seq)
+    keyframe_points.foreach_set('select_left_handle', key_sel_seq)
+    keyframe_points.foreach_set('select_right_handle', key_sel_seq)
+
+
+def key_fcurves(stc_dict, bl, field, header, default, default_values=None, key_tolerance=0.0):
 
     if not hasattr(bl, field):
         return
@@ -273,7 +329,10 @@ def key_fcurves(stc_dict, bl, field, header, default):
     path = bl.path_from_id(field)
 
     for ii, val in enumerate(default):
-        set_default_value(bl.id_data.m3_animations_default, path, ii, val)
+        if default_values is not None:
+            default_values.set(path, ii, val)
+        else:
+            set_default_value(bl.id_data.m3_animations_default, path, ii, val)
 
     if type(header) == shared.M3AnimHeaderProp:
         anim_id_data = stc_dict.get(int(header.hex_id, 16))
@@ -294,26 +353,23 @@ def key_fcurves(stc_dict, bl, field, header, default):
     if not anim_id_data:
         return
 
-    for action_name in anim_id_data.keys():
-        anim_id_action_data = anim_id_data[action_name]
-        points_len = len(anim_id_action_data[0]) // 2
+    if type(header) == shared.M3AnimHeaderProp:
+        interp = 0 if header.interpolation == 'CONSTANT' else 1  # TODO calculate AUTO based on field name
+    else:
+        interp = header.interpolation
+
+    actions = bpy.data.actions
 
-        if type(header) == shared.M3AnimHeaderProp:
-            interp_seq = [0 if header.interpolation == 'CONSTANT' else 1] * points_len  # TODO calculate AUTO based on field name
-        else:
-            interp_seq = [header.interpolation] * points_len
+    for action_name, anim_id_action_data in anim_id_data.items():
+        if key_tolerance:
+            anim_id_action_data = m3_keys_reduce(anim_id_action_data, key_tolerance, 'LINEAR' if interp else 'CONSTANT')
 
-        key_sel_seq = [False] * points_len
+        # the action is resolved once for all components of the anim id
+        fcurves = actions[action_name].fcurves
         for index, index_data in enumerate(anim_id_action_data):
-            fcurves = bpy.data.actions.get(action_name).fcurves
             fcurve = fcurves.new(path, index=index)
             fcurve.select = False
-            fcurve.keyframe_points.add(points_len)
-            fcurve.keyframe_points.foreach_set('co', index_data)
-            fcurve.keyframe_points.foreach_set('interpolation', interp_seq)
-            fcurve.keyframe_points.foreach_set('select_control_point', key_sel_seq)
-            fcurve.keyframe_points.foreach_set('select_left_handle', key_sel_seq)
-            fcurve.keyframe_points.foreach_set('select_right_handle', key_sel_seq)
+            fcurve_keys_set(fcurve, index_data, interp)
 
 
 def armature_object_new():
@@ -328,11 +384,15 @@ def armature_object_new():
 
 class Importer:
 
-    def __init__( self, bl_op=None ):
+    def __init__( self, bl_op=None, timings_path='', key_tolerance=0.0 ):
         self.filepath           = ''
         self.bl_op              = bl_op
+        self.key_tolerance      = key_tolerance  # keyframes are reduced within this tolerance if not 0
         self.warn_strings       = []
         self.exception_trace    = ''
+        self.timings_path       = timings_path  # optional JSON file for the timing report
+        self.timings            = []  # (stage name, seconds)
+        self.counts             = {}
 
     def do_report(self):
         if len(self.warn_strings):
@@ -348,137 +408,185 @@ class Importer:
                 self.bl_op.report({"ERROR"}, self.exception_trace)
         self.exception_trace = ''
 
-    def m3_import( self, filepath, ob=None, opts=None ):
+        if self.timings:
+            timing_strings = [f'{name}: {seconds:.3f}s' for name, seconds in self.timings]
+            count_strings = [f'{name}: {count}' for name, count in self.counts.items()]
+            info = f'M3 import of {self.filepath} took {sum(seconds for name, seconds in self.timings):.3f}s\n' + '\n'.join(timing_strings + count_strings)
+            if self.bl_op:
+                self.bl_op.report({"INFO"}, info)
+
+            if self.timings_path:
+                try:
+                    with open(self.timings_path, 'w') as f:
+                        json.dump({'filepath': self.filepath, 'stages': dict(self.timings), 'counts': self.counts}, f, indent=2)
+                except OSError as e:
+                    warning = f'The M3 import timing report could not be written to {self.timings_path}: {e}'
+                    print(warning)  # not for debugging
+                    if self.bl_op:
+                        self.bl_op.report({"WARNING"}, warning)
+        self.timings = []
+        self.counts = {}
+
+    def timed( self, name, func, *args, **kwargs ):
+        time_start = time.perf_counter()
+        result = func( *args, **kwargs )
+        self.timings.append( ( name, time.perf_counter() - time_start ) )
+        return result
+
+    def data_existing_get( self ):
+        return {
+            'bones': len( self.ob.data.bones ),
+            'objects': set( self.ob.children ),
+            'actions': set( bpy.data.actions ),
+        }
+
+    def data_counts_set( self, data_existing ):
+        # only the objects and actions created by the import are counted, so that existing data is not walked
+        meshes = [child.data for child in self.ob.children if child.type == 'MESH' and child not in data_existing['objects']]
+        fcurves = [fcurve for action in bpy.data.actions if action not in data_existing['actions'] for fcurve in action.fcurves]
+        self.counts = {
+            'bones': len( self.ob.data.bones ) - data_existing['bones'],
+            'vertices': sum( len( me.vertices ) for me in meshes ),
+            'fcurves': len( fcurves ),
+            'keyframes': sum( len( fcurve.keyframe_points ) for fcurve in fcurves ),
+        }
+
+    def m3_import( self, filepath, ob=None, opts=None, m3=None, subset=None ):
         '''
             파일경로부터 파일 로드 및 파싱 후 오브젝트 생성
             '''
+        for stage in self.m3_import_stages( filepath, ob, opts, m3, subset ):
+            pass
+
+    def m3_import_stages( self, filepath, ob=None, opts=None, m3=None, subset=None ):
+        '''
+            Generator version of m3_import which yields (index, count, name) before each stage is run,
+            so that the import can be spread over several UI updates. m3 may be given if it has already been loaded.
+            subset may map 'sequences', 'regions' and 'particle_systems' to sets of the m3 indices to import
+            '''
 
         self.filepath           = filepath
+        self.subset             = subset
         # TODO make fps an import option
         bpy.context.scene.render.fps = FRAME_RATE
 
         self.get_rig, self.get_anims, self.get_mesh, self.get_effects = opts if opts != None else [True] * 4
 
-        self.m3                 = io_m3.M3SectionList.load( filepath )
+        self.m3                 = m3 if m3 is not None else io_m3.M3SectionList.load( filepath )
         self.m3_model           = self.m3[self.m3[0][0].model][0]
         self.m3_division        = self.m3[self.m3_model.divisions][0]
 
         self.m3_bl_ref          = {}
-        self.bl_ref_objects     = []
+        self.bl_ref_objects     = {}  # section index tuple: volume mesh object
         self.stc_id_data        = {}
         self.final_bone_names   = {}
 
         self.is_new_object      = not ob
         self.ob = ob or armature_object_new()
+        self.default_values     = DefaultValueBatch( self.ob )
 
         anims_len               = len( self.ob.m3_animation_groups )
         matref_len              = len( self.ob.m3_materialrefs )
+        self.matref_len         = matref_len
         self.anim_index         = lambda x: anims_len + x
         self.matref_index       = lambda x: matref_len + x
 
         self.m3_struct_version_set_from_ref( 'm3_model_version', self.m3[0][0].model )
 
+        stages = []
+
         if self.get_rig:
             if self.get_anims:
-                self.create_animations()
-
-            self.create_bones()
-            self.create_attachments()
-            self.create_hittests()
-            self.create_rigid_bodies()
-            self.create_rigid_body_joints()
-            self.create_cameras()
-            self.create_billboards()
-            self.create_ik_joints()
-            self.create_turrets()
-            self.create_shadow_boxes()
-            self.create_tmd()
+                stages.append( self.create_animations )
+
+            stages.extend( (
+                self.create_bones,
+                self.create_attachments,
+                self.create_hittests,
+                self.create_rigid_bodies,
+                self.create_rigid_body_joints,
+                self.create_cameras,
+                self.create_billboards,
+                self.create_ik_joints,
+                self.create_turrets,
+                self.create_shadow_boxes,
+                self.create_tmd,
+            ) )
 
         if self.get_rig and self.get_mesh:
-            self.create_bounding()
+            stages.append( self.create_bounding )
 
         if self.get_mesh or self.get_effects:
-            self.create_materials()
+            stages.append( self.create_materials )
 
         if self.get_mesh:
-            self.create_mesh()
+            stages.append( self.create_mesh )
 
         if self.get_mesh and self.get_rig:
-            self.create_cloths()
+            stages.append( self.create_cloths )
 
         if self.get_effects:
-            self.create_lights()
-            self.create_particles()
-            self.create_ribbons()
-            self.create_projections()
-            self.create_forces()
-            self.create_warps()
+            stages.extend( (
+                self.create_lights,
+                self.create_particles,
+                self.create_ribbons,
+                self.create_projections,
+                self.create_forces,
+                self.create_warps,
+            ) )
+
+        stages.append( self.finish_import )
+        stages.append( self.prune_materials )
+
+        data_existing = self.data_existing_get()
+
+        for ii, stage in enumerate( stages ):
+            yield ii, len( stages ), stage.__name__
+            self.timed( stage.__name__, stage )
+
+        self.data_counts_set( data_existing )
+
+    def finish_import( self ):
+        self.default_values.flush()
 
         if self.is_new_object:
             ob_anim_data_set(bpy.context.scene, self.ob, None)
             bpy.context.view_layer.objects.active = self.ob
             self.ob.select_set(True)
 
-        # lazy way to filter out materials unused by the imported data, but it works
-        user_matref_index = self.ob.m3_materialrefs_index
-        for ii in reversed(range(len(self.ob.m3_materialrefs))[matref_len:]):
-            self.ob.m3_materialrefs_index = ii
-            bpy.ops.m3.material_remove('INVOKE_DEFAULT', quiet=True)
-        self.ob.m3_materialrefs_index = user_matref_index
-
-    def m3a_import( self, filepath, ob ):
-
-        def get_m3_id_props():
-            hex_id_to_props = {}
-
-            collections = [
-                ob.m3_cameras, ob.m3_forces, ob.m3_lights, ob.m3_materiallayers, ob.m3_materials_standard, ob.m3_materials_displacement,
-                ob.m3_materials_composite, ob.m3_materials_volume, ob.m3_materials_volumenoise, ob.m3_materials_reflection, ob.m3_materials_lensflare,
-                ob.m3_particlesystems, ob.m3_particlecopies, ob.m3_projections, ob.m3_ribbons, ob.m3_ribbonsplines, ob.m3_shadowboxes, ob.m3_warps,
-            ]
-
-            def get_anim_ids(collection):
-                for item in collection:
-                    for key in type(item).__annotations__.keys():
-                        prop = getattr(item, key)
-                        if type(prop) == shared.M3AnimHeaderProp:
-                            prop_path = prop.path_from_id()[:-7]  # removing the _header suffix
-                            prop_id_int = int(prop.hex_id, 16)
-                            try:
-                                hex_id_to_props[prop_id_int].append(prop_path)
-                            except KeyError:
-                                hex_id_to_props[prop_id_int] = [prop_path]
-                        elif str(type(prop)) == '<class \'bpy_prop_collection_idprop\'>':
-                            get_anim_ids(prop)
-
-            for collection in collections:
-                get_anim_ids(collection)
-
-            return hex_id_to_props
+    def prune_materials( self ):
+        # filter out materials unused by the imported data
+        m3_materials_prune(self.ob, self.matref_len)
+
+    def m3a_import( self, filepath, ob, m3=None, subset=None ):
 
         # TODO make fps an import options
         bpy.context.scene.render.fps = FRAME_RATE
         ob_anim_data_set(bpy.context.scene, ob, None)
 
         self.is_new_object  = False
+        self.subset         = subset
         self.ob             = ob
-        self.m3             = io_m3.M3SectionList.load( filepath )
+        self.m3             = m3 if m3 is not None else io_m3.M3SectionList.load( filepath )
         self.m3_model       = self.m3[self.m3[0][0].model][0]
         self.stc_id_data    = {}
+        self.default_values = DefaultValueBatch( ob )
 
         anims_len = len(self.ob.m3_animation_groups)
         self.anim_index = lambda x: anims_len + x
         self.create_animations()
 
-        m3_id_prop_paths = get_m3_id_props()
+        m3_id_prop_paths = shared.m3_anim_id_props_get(ob)
 
         for anim_id_data, paths in m3_id_prop_paths.items():
             rs = paths[0].rsplit('.', 1)
             prop = ob.path_resolve(paths[0])
             try:  # put prop in a tuple if it is not already
-                key_fcurves(self.stc_id_data, ob.path_resolve(rs[0]), rs[1], ob.path_resolve(paths[0] + '_header'), prop)
+                key_fcurves(self.stc_id_data, ob.path_resolve(rs[0]), rs[1], ob.path_resolve(paths[0] + '_header'), prop, self.default_values, self.key_tolerance)
             except TypeError:
-                key_fcurves(self.stc_id_data, ob.path_resolve(rs[0]), rs[1], ob.path_resolve(paths[0] + '_header'), (prop,))
+                key_fcurves(self.stc_id_data, ob.path_resolve(rs[0]), rs[1], ob.path_resolve(paths[0] + '_header'), (prop,), self.default_values, self.key_tolerance)
+
+        self.default_values.flush()
 
         bind_mats = {}
         for pb in ob.pose.bones:
@@ -509,6 +617,9 @@ class Importer:
 
             self.animate_pose_bone(anim_ids, defaults, pb, left_in_mat, right_in_mat)
 
+    def subset_has(self, key, index):
+        return self.subset is None or self.subset.get(key) is None or index in self.subset[key]
+
     def m3_struct_version_set_from_ref(self, version_attr, ref):
 
         if ref.index and ref.entries:
@@ -548,6 +659,11 @@ class Importer:
             anim_data_rot = id_data_rot.get(action_name, None)
             anim_data_scl = id_data_scl.get(action_name, None)
 
+            if self.key_tolerance:
+                anim_data_loc = anim_data_loc and m3_keys_reduce(anim_data_loc, self.key_tolerance)
+                anim_data_rot = anim_data_rot and m3_keys_reduce(anim_data_rot, self.key_tolerance, 'QUATERNION_LINEAR')
+                anim_data_scl = anim_data_scl and m3_keys_reduce(anim_data_scl, self.key_tolerance)
+
             anim_data_loc_none = not anim_data_loc
             if anim_data_loc_none:
                 anim_data_loc = [[0, default_loc.x], [0, default_loc.y], [0, default_loc.z]]
@@ -573,41 +689,23 @@ class Importer:
             # store fcurve references so that we don't have to find them later
             fcurves_loc = []
             for index, index_data in enumerate(anim_data_loc):
-                points_len = len(index_data) // 2
                 fcurve = fcurves.new(pose_bone.path_from_id('location'), index=index, action_group=pose_bone.name)
                 fcurve.select = False
-                fcurve.keyframe_points.add(points_len)
-                fcurve.keyframe_points.foreach_set('co', index_data)
-                fcurve.keyframe_points.foreach_set('interpolation', [1] * points_len)
-                fcurve.keyframe_points.foreach_set('select_control_point', key_sel := [False] * points_len)
-                fcurve.keyframe_points.foreach_set('select_left_handle', key_sel)
-                fcurve.keyframe_points.foreach_set('select_right_handle', key_sel)
+                fcurve_keys_set(fcurve, index_data, 1)
                 fcurves_loc.append(fcurve)
 
             fcurves_rot = []
             for index, index_data in enumerate(anim_data_rot):
-                points_len = len(index_data) // 2
                 fcurve = fcurves.new(pose_bone.path_from_id('rotation_quaternion'), index=index, action_group=pose_bone.name)
                 fcurve.select = False
-                fcurve.keyframe_points.add(points_len)
-                fcurve.keyframe_points.foreach_set('co', index_data)
-                fcurve.keyframe_points.foreach_set('interpolation', [1] * points_len)
-                fcurve.keyframe_points.foreach_set('select_control_point', key_sel := [False] * points_len)
-                fcurve.keyframe_points.foreach_set('select_left_handle', key_sel)
-                fcurve.keyframe_points.foreach_set('select_right_handle', key_sel)
+                fcurve_keys_set(fcurve, index_data, 1)
                 fcurves_rot.append(fcurve)
 
             fcurves_scl = []
             for index, index_data in enumerate(anim_data_scl):
-                points_len = len(index_data) // 2
                 fcurve = fcurves.new(pose_bone.path_from_id('scale'), index=index, action_group=pose_bone.name)
                 fcurve.select = False
-                fcurve.keyframe_points.add(points_len)
-                fcurve.keyframe_points.foreach_set('co', index_data)
-                fcurve.keyframe_points.foreach_set('interpolation', [1] * points_len)
-                fcurve.keyframe_points.foreach_set('select_control_point', key_sel := [False] * points_len)
-                fcurve.keyframe_points.foreach_set('select_left_handle', key_sel)
-                fcurve.keyframe_points.foreach_set('select_right_handle', key_sel)
+                fcurve_keys_set(fcurve, index_data, 1)
                 fcurves_scl.append(fcurve)
 
             new_anim_data = [[], [], []]
@@ -681,7 +779,10 @@ class Importer:
         update_anim_lock = ob.m3_options.update_anim_data
         ob.m3_options.update_anim_data = False
 
-        for m3_seq, m3_stg in zip(self.m3[self.m3_model.sequences], self.m3[self.m3_model.sequence_transformation_groups]):
+        for seq_ii, (m3_seq, m3_stg) in enumerate(zip(self.m3[self.m3_model.sequences], self.m3[self.m3_model.sequence_transformation_groups])):
+            if not self.subset_has('sequences', seq_ii):
+                continue
+
             anim_group_name = self.m3[m3_seq.name].content_to_string()
             anim_group = shared.m3_item_add(ob.m3_animation_groups, anim_group_name)
             seq_processor = M3InputProcessor(self, anim_group, m3_seq)
@@ -747,104 +848,133 @@ class Importer:
 
     def create_bones(self):
 
-        def get_bone_tails(m3_bones, bone_heads, bone_vectors):
-            child_bone_indices = [[] for ii in m3_bones]
-            for bone_index, bone_entry in enumerate(m3_bones):
-                if bone_entry.parent != -1:
-                    child_bone_indices[bone_entry.parent].append(bone_index)
-
-            tails = []
-
-            for m3_bone, child_indices, head, vector in zip(m3_bones, child_bone_indices, bone_heads, bone_vectors):
-                length = 0.1
-                for child_index in child_indices:
-                    head_to_child_head = bone_heads[child_index] - head
-                    if head_to_child_head.length >= 0.01 and abs(head_to_child_head.angle(vector)) < 0.1:
-                        length = head_to_child_head.length
-                tail_offset = length * vector
-                tail = head + tail_offset
-                while (tail - head).length == 0:
-                    tail_offset *= 2
-                    tail = head + tail_offset
-                tails.append(tail)
+        def get_bone_rests(irefs):
+            mats = np.array([(
+                (iref.matrix.x.x, iref.matrix.y.x, iref.matrix.z.x, iref.matrix.w.x),
+                (iref.matrix.x.y, iref.matrix.y.y, iref.matrix.z.y, iref.matrix.w.y),
+                (iref.matrix.x.z, iref.matrix.y.z, iref.matrix.z.z, iref.matrix.w.z),
+                (iref.matrix.x.w, iref.matrix.y.w, iref.matrix.z.w, iref.matrix.w.w),
+            ) for iref in irefs], dtype=np.float64).reshape(-1, 4, 4)
 
-            return tails
+            # the sign of the scale is negative for all axes when the matrix mirrors, as in Matrix.to_scale
+            scale_signs = np.where(np.linalg.det(mats[:, :3, :3]) < 0, -1.0, 1.0)
 
-        def get_bone_rolls(bone_rests, bone_heads, bone_tails):
-            rolls = []
-            for iref, head, tail in zip(bone_rests, bone_heads, bone_tails):
-                v = (tail - head).normalized()
-                target = mathutils.Vector((0, 1, 0))
-                axis = target.cross(v)
-                if axis.dot(axis) > 0.000001:
-                    axis.normalize()
-                    theta = target.angle(v)
-                    b_matrix = mathutils.Matrix.Rotation(theta, 3, axis)
-                else:
-                    sign = 1 if target.dot(v) > 0 else -1
-                    b_matrix = mathutils.Matrix((
-                        (sign, 0, 0),
-                        (0, sign, 0),
-                        (0, 0, 1),
-                    ))
+            # TODO replace this with a correction on the pose data
+            mats[:, :3] *= scale_signs[:, None, None]
 
-                rot_matrix = mathutils.Matrix.Rotation(0, 3, v) @ b_matrix
-                rot_matrix = rot_matrix.to_4x4()
-                rot_matrix.translation = head
-                matrix33 = rot_matrix.to_3x3()
+            # calculating scale vector manually since for some reason blender tends to come up with something else.
+            bind_scales = np.linalg.norm(mats[:, :3, :3], axis=2) * scale_signs[:, None]
 
-                z_x = matrix33.col[2].angle(iref.col[0].to_3d())
-                z_z = matrix33.col[2].angle(iref.col[2].to_3d())
+            rests = np.tile(np.identity(4), (len(mats), 1, 1))
+            invertible = np.linalg.det(mats) != 0
+            rests[invertible] = np.linalg.inv(mats[invertible])
+            rests = rests @ np.array(io_shared.rot_fix_matrix)
 
-                roll_angle = z_z if z_x > math.pi / 2 else -z_z
-                rolls.append(roll_angle)
+            return rests, bind_scales
 
-            return rolls
+        def get_bone_tails(parents, bone_heads, bone_vectors):
+            lengths = np.full(len(parents), 0.1)
 
-        def get_edit_bones(m3_bones, bone_heads, bone_tails, bone_rolls):
-            edit_bones = []
+            children = np.flatnonzero(parents != -1)
+            head_to_child_heads = bone_heads[children] - bone_heads[parents[children]]
+            distances = np.linalg.norm(head_to_child_heads, axis=1)
+            angles = vectors_angle(head_to_child_heads, bone_vectors[parents[children]])
+            matches = np.flatnonzero((distances >= 0.01) & (angles < 0.1))
 
-            for index, m3_bone in enumerate(m3_bones):
-                m3_bone_name = self.m3[m3_bone.name].content_to_string()
-                edit_bone = self.ob.data.edit_bones.new(m3_bone_name)
-                self.final_bone_names[index] = edit_bone.name
-                edit_bones.append(edit_bone)
+            # the last matching child of each parent determines the length
+            match_parents = parents[children[matches]][::-1]
+            match_parents, first = np.unique(match_parents, return_index=True)
+            lengths[match_parents] = distances[matches][::-1][first]
 
-            for index, m3_bone in enumerate(m3_bones):
-                edit_bone = edit_bones[index]
-                edit_bone.head = bone_heads[index]
-                edit_bone.tail = bone_tails[index]
-                edit_bone.roll = bone_rolls[index]
-                edit_bone.select_tail = False
+            tail_offsets = lengths[:, None] * bone_vectors
+            tails = bone_heads + tail_offsets
 
-                if m3_bone.parent != -1:
-                    parent_edit_bone = self.ob.data.edit_bones[m3_bone.parent]
-                    edit_bone.parent = parent_edit_bone
-                    parent_child_vector = parent_edit_bone.tail - edit_bone.head
+            # offsets below float precision of the head are doubled until the tail differs from the head
+            heads32 = bone_heads.astype(np.float32)
+            collapsed = (tails.astype(np.float32) == heads32).all(axis=1) & bone_vectors.any(axis=1)
+            while collapsed.any():
+                tail_offsets[collapsed] *= 2
+                tails = bone_heads + tail_offsets
+                collapsed &= (tails.astype(np.float32) == heads32).all(axis=1)
 
-                    if parent_child_vector.length < 0.000001:
-                        edit_bone.use_connect = True
-                    else:
-                        # fixes precision errors in applying roll caused by Blender
-                        for ii in range(0, 3):
-                            if abs(edit_bone.head[ii] - edit_bone.tail[ii]) < 0.00005:
-                                edit_bone.tail[ii] = edit_bone.head[ii]
+            return tails
 
-            return edit_bones
+        def get_bone_rolls(bone_rests, bone_heads, bone_tails):
+            v = vectors_normalized(bone_tails - bone_heads)
+            z_axes = np.tile((0.0, 0.0, 1.0), (len(v), 1))
 
-        def get_edit_bone_relations(m3_bones, edit_bones):
-            rel_mats = []
-            for m3_bone, edit_bone in zip(m3_bones, edit_bones):
+            # z axis of the rotation which takes the y axis onto each bone vector, per Matrix.Rotation(theta, 3, axis)
+            axes = np.cross((0.0, 1.0, 0.0), v)
+            rotated = (axes * axes).sum(axis=1) > 0.000001
+            axes = vectors_normalized(axes[rotated])
+            cos_theta = np.clip(v[rotated, 1], -1.0, 1.0)
+            sin_theta = np.sin(np.arccos(cos_theta))
+            z_axes[rotated] = (cos_theta[:, None] * z_axes[rotated] + sin_theta[:, None] * np.cross(axes, (0.0, 0.0, 1.0)) +
+                               (1.0 - cos_theta)[:, None] * axes * axes[:, 2:3])
 
-                if m3_bone.parent != -1:
-                    parent_edit_bone = self.ob.data.edit_bones.get(self.m3_get_bone_name(m3_bone.parent))
-                    rel_mats.append((parent_edit_bone.matrix.inverted() @ edit_bone.matrix).inverted())
-                else:
-                    rel_mats.append(edit_bone.matrix.inverted())
+            z_x = vectors_angle(z_axes, bone_rests[:, :3, 0])
+            z_z = vectors_angle(z_axes, bone_rests[:, :3, 2])
+
+            return np.where(z_x > math.pi / 2, z_z, -z_z)
+
+        def get_edit_bones(m3_bones, parents, bone_heads, bone_tails, bone_rolls):
+            edit_bones = self.ob.data.edit_bones
+            edit_bones_len = len(edit_bones)
+            new_edit_bones = []
+
+            for index, m3_bone in enumerate(m3_bones):
+                edit_bone = edit_bones.new(self.m3[m3_bone.name].content_to_string())
+                self.final_bone_names[index] = edit_bone.name
+                new_edit_bones.append(edit_bone)
 
-            return rel_mats
+            bone_heads = bone_heads.astype(np.float32)
+            bone_tails = bone_tails.astype(np.float32)
+            connected = np.zeros(len(m3_bones), dtype=bool)
+
+            # visited in index order since the tail of a parent decides whether its children connect
+            for index in np.flatnonzero(parents != -1):
+                parent_child_vector = bone_tails[parents[index]] - bone_heads[index]
+
+                if np.linalg.norm(parent_child_vector) < 0.000001:
+                    connected[index] = True
+                else:
+                    # fixes precision errors in applying roll caused by Blender
+                    snap = np.abs(bone_heads[index] - bone_tails[index]) < 0.00005
+                    bone_tails[index, snap] = bone_heads[index, snap]
+
+            def foreach_set_new(attr, values, size=1):
+                data = np.empty(len(edit_bones) * size, dtype=values.dtype)
+                edit_bones.foreach_get(attr, data)
+                data[edit_bones_len * size:] = values.ravel()
+                edit_bones.foreach_set(attr, data)
+
+            foreach_set_new('head', bone_heads, 3)
+            foreach_set_new('tail', bone_tails, 3)
+            foreach_set_new('roll', bone_rolls.astype(np.float32))
+            foreach_set_new('select_tail', np.zeros(len(m3_bones), dtype=bool))
+
+            for index in np.flatnonzero(parents != -1):
+                edit_bone = new_edit_bones[index]
+                edit_bone.parent = new_edit_bones[parents[index]]
+                if connected[index]:
+                    edit_bone.use_connect = True
+
+            mats = np.empty(len(edit_bones) * 16, dtype=np.float32)
+            edit_bones.foreach_get('matrix', mats)
+
+            # matrices are flattened column by column
+            return mats.reshape(-1, 4, 4)[edit_bones_len:].transpose(0, 2, 1).astype(np.float64)
+
+        def get_edit_bone_relations(parents, edit_bone_matrices):
+            rel_mats = np.linalg.inv(edit_bone_matrices)
+            children = np.flatnonzero(parents != -1)
+            # inverse of the parent inverse times the bone matrix
+            rel_mats[children] = rel_mats[children] @ edit_bone_matrices[parents[children]]
+            return [mathutils.Matrix(rel_mat.tolist()) for rel_mat in rel_mats]
 
         def adjust_pose_bones(m3_bones, edit_bone_relations, bind_scales, bind_matrices):
+            pose_bones = self.ob.pose.bones
+
             for ii, m3_bone, rel_mat, bind_scl, bind_mat in zip(range(len(m3_bones)), m3_bones, edit_bone_relations, bind_scales, bind_matrices):
 
                 if m3_bone.parent != -1:
@@ -854,7 +984,7 @@ class Importer:
                 right_mat = bind_mat @ io_shared.rot_fix_matrix
                 bone_mat_comp = to_bl_vec3(m3_bone.location.default), to_bl_quat(m3_bone.rotation.default), to_bl_vec3(m3_bone.scale.default)
                 bone_mat = mathutils.Matrix.LocRotScale(*bone_mat_comp)
-                pose_bone = self.ob.pose.bones.get(self.m3_get_bone_name(ii))
+                pose_bone = pose_bones[self.final_bone_names[ii]]
                 pose_bone.matrix_basis = left_mat @ bone_mat @ right_mat
                 pose_bone.bl_handle = shared.m3_handle_gen()
                 pose_bone.m3_bind_scale = (bind_scl[1], bind_scl[0], bind_scl[2])
@@ -872,61 +1002,28 @@ class Importer:
                 m3_anim_ids = (m3_bone.location.header.id, m3_bone.rotation.header.id, m3_bone.scale.header.id, m3_bone.batching.header.id)
                 m3_defaults = (m3_bone.location.default, m3_bone.rotation.default, m3_bone.scale.default)
 
-                set_default_value(self.ob.m3_animations_default, pose_bone.path_from_id('location'), 0, pose_bone.location[0])
-                set_default_value(self.ob.m3_animations_default, pose_bone.path_from_id('location'), 1, pose_bone.location[1])
-                set_default_value(self.ob.m3_animations_default, pose_bone.path_from_id('location'), 2, pose_bone.location[2])
-                set_default_value(self.ob.m3_animations_default, pose_bone.path_from_id('rotation_quaternion'), 0, pose_bone.rotation_quaternion[0])
-                set_default_value(self.ob.m3_animations_default, pose_bone.path_from_id('rotation_quaternion'), 1, pose_bone.rotation_quaternion[1])
-                set_default_value(self.ob.m3_animations_default, pose_bone.path_from_id('rotation_quaternion'), 2, pose_bone.rotation_quaternion[2])
-                set_default_value(self.ob.m3_animations_default, pose_bone.path_from_id('rotation_quaternion'), 3, pose_bone.rotation_quaternion[3])
-                set_default_value(self.ob.m3_animations_default, pose_bone.path_from_id('scale'), 0, pose_bone.scale[0])
-                set_default_value(self.ob.m3_animations_default, pose_bone.path_from_id('scale'), 1, pose_bone.scale[1])
-                set_default_value(self.ob.m3_animations_default, pose_bone.path_from_id('scale'), 2, pose_bone.scale[2])
-                set_default_value(self.ob.m3_animations_default, pose_bone.path_from_id('m3_batching'), 0, pose_bone.m3_batching)
+                for path_attr in ('location', 'rotation_quaternion', 'scale'):
+                    path = pose_bone.path_from_id(path_attr)
+                    for index, value in enumerate(getattr(pose_bone, path_attr)):
+                        self.default_values.set(path, index, value)
+                self.default_values.set(pose_bone.path_from_id('m3_batching'), 0, pose_bone.m3_batching)
                 self.animate_pose_bone(m3_anim_ids, m3_defaults, pose_bone, left_mat, right_mat)
 
         bpy.context.view_layer.objects.active = self.ob
 
-        bone_rests = []
-        bind_scales = []
-        bind_matrices = []
-        bone_heads = []
-        bone_vectors = []
-
         m3_bones = self.m3[self.m3_model.bones]
+        parents = np.array([m3_bone.parent for m3_bone in m3_bones], dtype=np.int64)
 
-        for iref, m3_bone in zip(self.m3[self.m3_model.bone_rests], m3_bones):
-            mat = to_bl_matrix(iref.matrix)
-            mat_scale = mat.to_scale()
+        bone_rests, bind_scales = get_bone_rests(self.m3[self.m3_model.bone_rests][:len(m3_bones)])
+        bind_matrices = [mathutils.Matrix.LocRotScale(None, None, bind_scale.tolist()) for bind_scale in bind_scales]
+        bone_heads = bone_rests[:, :3, 3]
+        bone_vectors = vectors_normalized(bone_rests[:, :3, 1])
 
-            # TODO replace this with a correction on the pose data
-            for ii in range(3):
-                if mat_scale[ii] < 0:
-                    mat[ii] = -mat[ii]
-
-            try:
-                bone_rests.append(mat.inverted() @ io_shared.rot_fix_matrix)
-            except ValueError:
-                bone_rests.append(mathutils.Matrix() @ io_shared.rot_fix_matrix)
-
-            # calculating scale vector manually since for some reason blender tends to come up with something else.
-            # still using blender's scale calculation to get the sign of the scale tho.
-            bind_scale = mathutils.Vector((
-                mathutils.Vector(mat[0][0:3]).length * (-1 if mat_scale[0] < 0 else 1),
-                mathutils.Vector(mat[1][0:3]).length * (-1 if mat_scale[1] < 0 else 1),
-                mathutils.Vector(mat[2][0:3]).length * (-1 if mat_scale[2] < 0 else 1),
-            ))
-
-            bind_scales.append(bind_scale)
-            bind_matrices.append(mathutils.Matrix.LocRotScale(None, None, bind_scale))
-            bone_heads.append(bone_rests[-1].translation)
-            bone_vectors.append(bone_rests[-1].col[1].to_3d().normalized())
-
-        bone_tails = get_bone_tails(m3_bones, bone_heads, bone_vectors)
+        bone_tails = get_bone_tails(parents, bone_heads, bone_vectors)
         bone_rolls = get_bone_rolls(bone_rests, bone_heads, bone_tails)
         bpy.ops.object.mode_set(mode='EDIT', toggle=False)
-        edit_bones = get_edit_bones(m3_bones, bone_heads, bone_tails, bone_rolls)
-        edit_bone_relations = get_edit_bone_relations(m3_bones, edit_bones)
+        edit_bone_matrices = get_edit_bones(m3_bones, parents, bone_heads, bone_tails, bone_rolls)
+        edit_bone_relations = get_edit_bone_relations(parents, edit_bone_matrices)
         bpy.ops.object.mode_set(mode='OBJECT', toggle=False)
 
         adjust_pose_bones(m3_bones, edit_bone_relations, bind_scales, bind_matrices)
@@ -1032,12 +1129,11 @@ class Importer:
             return
 
         self.m3_struct_version_set_from_ref('m3_mesh_version', self.m3_division.regions)
-        m3_vertices = self.m3[self.m3_model.vertices]
+        # vertices are decoded per region, so that regions which are not imported are never decoded
+        m3_vertices_buffer = memoryview(self.m3[self.m3_model.vertices].raw_bytes)
 
         v_colors = self.m3_model.bit_get('vertex_flags', 'color')
         v_class_desc = io_m3.M3StructureDescription.get_vertex_description(self.m3_model.vertex_flags)
-        v_count = len(m3_vertices) // v_class_desc.size
-        m3_vertices = v_class_desc.instances(buffer=m3_vertices.raw_bytes, count=v_count)
         bone_lookup_full = self.m3[self.m3_model.bone_lookup]
 
         if self.m3_model.bit_get('vertex_flags', 'skin0') and self.m3_model.bit_get('vertex_flags', 'skin1'):
@@ -1059,10 +1155,12 @@ class Importer:
         for region_ii, region in enumerate(self.m3[self.m3_division.regions]):
             region_batches = [batch for batch in m3_batches if batch.region_index == region_ii]
 
-            if not region_batches:
+            if not region_batches or not self.subset_has('regions', region_ii):
                 continue
 
-            regn_m3_verts = m3_vertices[region.first_vertex_index:region.first_vertex_index + region.vertex_count]
+            regn_m3_verts_offset = region.first_vertex_index * v_class_desc.size
+            regn_m3_verts_buffer = m3_vertices_buffer[regn_m3_verts_offset:regn_m3_verts_offset + region.vertex_count * v_class_desc.size]
+            regn_m3_verts = v_class_desc.instances(buffer=regn_m3_verts_buffer, count=len(regn_m3_verts_buffer) // v_class_desc.size)
             regn_m3_faces = m3_faces[region.first_face_index:region.first_face_index + region.face_count]
             regn_uv_multiply = getattr(region, 'uv_multiply', 16)
             regn_uv_offset = getattr(region, 'uv_offset', 0)
@@ -1328,13 +1426,18 @@ class Importer:
             io_shared.io_particle_copy(processor)
 
         system_handles = []
-        prev_particles = len(ob.m3_particlesystems)
+        systems = []
+
+        for system_ii, m3_system in enumerate(m3_systems):
+            if not self.subset_has('particle_systems', system_ii):
+                system_handles.append('')
+                continue
 
-        for m3_system in m3_systems:
             pose_bone_name = self.m3_get_bone_name(m3_system.bone)
             pose_bone = ob.pose.bones.get(pose_bone_name) if pose_bone_name else None
             system = shared.m3_item_add(ob.m3_particlesystems, item_name=pose_bone_name)
             system_handles.append(system.bl_handle)
+            systems.append((system, m3_system))
             system.bone.handle = pose_bone.bl_handle if pose_bone else ''
             system.material.handle = ob.m3_materialrefs[self.matref_index(m3_system.material_reference_index)].bl_handle
 
@@ -1371,7 +1474,7 @@ class Importer:
                     mesh_object_pointer = system.emit_shape_meshes.add()
                     try:
                         mesh_object_pointer.bl_object = self.m3_bl_ref.get(self.m3_division.regions.index)[region_indice]
-                    except TypeError:  # for when get() returns None
+                    except (TypeError, KeyError):  # for when get() returns None, or the region was not imported
                         self.warn_strings.append(f'No matching mesh found for particle system {system}. Unable to assign mesh shape emitter {region_indice}.')
 
             for m3_point in self.m3[m3_system.emit_shape_spline]:
@@ -1388,7 +1491,7 @@ class Importer:
             if m3_modelpaths:  # it is only valid to have 1 path given
                 system.model_path = self.m3[m3_modelpaths[0].path].content_to_string()
 
-        for system, m3_system in zip(ob.m3_particlesystems[prev_particles:], m3_systems):
+        for system, m3_system in systems:
             system.collide_system.handle = system_handles[m3_system.collide_system] if m3_system.collide_system >= 0 else ''
             system.trail_system.handle = system_handles[m3_system.trail_system] if m3_system.trail_system >= 0 else ''
 
@@ -1407,9 +1510,8 @@ class Importer:
             io_shared.io_ribbon(processor)
 
             if m3_ribbon.spline.index:
-                for ref in self.bl_ref_objects:
-                    if [m3_ribbon.spline.index] == ref['sections']:
-                        ribbon.spline.handle = ref['ob'].bl_handle
+                if m3_ribbon.spline.index in self.m3_bl_ref:
+                    ribbon.spline.handle = self.m3_bl_ref[m3_ribbon.spline.index].bl_handle
                 else:
                     m3_spline = self.m3[m3_ribbon.spline]
                     spline = shared.m3_item_add(ob.m3_ribbonsplines, item_name=ribbon.name + '_spline')
@@ -1591,9 +1693,8 @@ class Importer:
             io_shared.io_cloth(processor)
 
             if m3_cloth.constraints.index:
-                for ref in self.bl_ref_objects:
-                    if [m3_cloth.constraints.index] == ref['sections']:
-                        cloth.constraint_set.handle = ref['ob'].bl_handle
+                if m3_cloth.constraints.index in self.m3_bl_ref:
+                    cloth.constraint_set.handle = self.m3_bl_ref[m3_cloth.constraints.index].bl_handle
                 else:
                     m3_constraints = self.m3[m3_cloth.constraints]
                     constraint_set = shared.m3_item_add(ob.m3_clothconstraintsets, item_name=cloth.name + '_constraints')
@@ -1614,8 +1715,8 @@ class Importer:
             # seems not all cloth behaviors have cloth meshes of their own. perhaps to hold constraints which interact with cloths of other models?
             if self.m3[m3_cloth.influence_map]:
                 m3_cloth_objects = self.m3[m3_cloth.influence_map][0]
-                cloth.mesh_object = self.m3_bl_ref.get(self.m3_division.regions.index)[m3_cloth_objects.influenced_region_index]
-                cloth.simulator_object = self.m3_bl_ref.get(self.m3_division.regions.index)[m3_cloth_objects.simulation_region_index]
+                cloth.mesh_object = self.m3_bl_ref.get(self.m3_division.regions.index).get(m3_cloth_objects.influenced_region_index)
+                cloth.simulator_object = self.m3_bl_ref.get(self.m3_division.regions.index).get(m3_cloth_objects.simulation_region_index)
 
             # because create_mesh() can perform destructive operations, cloth vertex data can possibly become corrupted.
             # if problems occur it may be necessary to make the new/old vertex data maps accessible outside of the create_mesh() function.
@@ -1624,17 +1725,10 @@ class Importer:
 
             cloth_vertex_sim = self.m3[m3_cloth.vertex_simulated]
 
-            bpy.context.view_layer.objects.active = cloth.simulator_object
-            bpy.ops.object.mode_set(mode='EDIT')
             me = cloth.simulator_object.data
-            bm = bmesh.from_edit_mesh(me)
-
-            layer = bm.verts.layers.int.get('m3clothsim') or bm.verts.layers.int.new('m3clothsim')
-            for vert in bm.verts:
-                vert[layer] = cloth_vertex_sim[vert.index]
-
-            bmesh.update_edit_mesh(me)
-            bpy.ops.object.mode_set(mode='OBJECT')
+            attribute = me_attribute_cloth_sim(me)
+            attribute.data.foreach_set('value', [cloth_vertex_sim[ii] for ii in range(len(me.vertices))])
+            me.update()
 
     def create_ik_joints(self):
         ob = self.ob
@@ -1731,9 +1825,9 @@ class Importer:
         if not (m3_vert_ref.index and m3_vert_ref.entries and m3_face_ref.index and m3_face_ref.entries):
             return
 
-        for ref in self.bl_ref_objects:
-            if [m3_vert_ref.index, m3_face_ref.index] == ref['sections']:
-                return ref['ob']
+        sections = (m3_vert_ref.index, m3_face_ref.index)
+        if sections in self.bl_ref_objects:
+            return self.bl_ref_objects[sections]
 
         me = bpy.data.meshes.new(name)
         me_ob = bpy.data.objects.new(me.name, me)
@@ -1763,7 +1857,7 @@ class Importer:
         me.validate()
         me.update(calc_edges=True)
 
-        self.bl_ref_objects.append({'sections': [m3_vert_ref.index, m3_face_ref.index], 'ob': me_ob})
+        self.bl_ref_objects[sections] = me_ob
 
         return me_ob
 
@@ -1772,9 +1866,9 @@ class Importer:
         if not (m3_vert_ref.index and m3_vert_ref.entries and m3_loop_ref.index and m3_loop_ref.entries and m3_poly_ref.index and m3_poly_ref.entries):
             return
 
-        for ref in self.bl_ref_objects:
-            if [m3_vert_ref.index, m3_loop_ref.index, m3_poly_ref] == ref['sections']:
-                return ref['ob']
+        sections = (m3_vert_ref.index, m3_loop_ref.index, m3_poly_ref.index)
+        if sections in self.bl_ref_objects:
+            return self.bl_ref_objects[sections]
 
         me = bpy.data.meshes.new(name)
         me_ob = bpy.data.objects.new(me.name, me)
@@ -1791,48 +1885,142 @@ class Importer:
         bl_loop_data = self.m3[m3_loop_ref].content
         bl_poly_data = self.m3[m3_poly_ref].content
 
-        loop_indices = {ii: [] for ii in bl_poly_data}
+        # each polygon references its first loop, and each loop references the next loop of the polygon
         bl_loop_data_ordered = []
+        bl_loop_start_ordered = []
+        bl_loop_total = []
         for ii in bl_poly_data:
+            bl_loop_start_ordered.append(len(bl_loop_data_ordered))
+            walked_indices = set()
             loop_index = ii
-            while loop_index not in loop_indices[ii]:
-                loop_indices[ii].append(loop_index)
+            while loop_index not in walked_indices:
+                walked_indices.add(loop_index)
                 bl_loop_data_ordered.append(bl_loop_data[loop_index].vertex)
                 loop_index = bl_loop_data[loop_index].loop
-
-        bl_loop_start_ordered = []
-        num = 0
-        for ii in loop_indices:
-            bl_loop_start_ordered.append(num)
-            num += len(loop_indices[ii])
+            bl_loop_total.append(len(walked_indices))
 
         me.vertices.add(len(bl_vert_data) // 3)
         me.vertices.foreach_set('co', bl_vert_data)
-        me.loops.add(len(bl_loop_data))
-        me.loops.foreach_set('vertex_index', [ii for ii in bl_loop_data_ordered])
+        me.loops.add(len(bl_loop_data_ordered))
+        me.loops.foreach_set('vertex_index', bl_loop_data_ordered)
         me.polygons.add(len(bl_poly_data))
-        me.polygons.foreach_set('loop_start', [ii for ii in bl_loop_start_ordered])
-        me.polygons.foreach_set('loop_total', [len(loop_indices[ii]) for ii in bl_poly_data])
+        me.polygons.foreach_set('loop_start', bl_loop_start_ordered)
+        me.polygons.foreach_set('loop_total', bl_loop_total)
 
         me.validate()
         me.update(calc_edges=True)
 
-        self.bl_ref_objects.append({'sections': [m3_vert_ref.index, m3_loop_ref.index, m3_poly_ref], 'ob': me_ob})
+        self.bl_ref_objects[sections] = me_ob
 
         return me_ob
 
 
-def m3_import( filepath, ob=None, bl_op=None, opts=None ):
-    importer = Importer( bl_op )
+def m3_load( filepath, lazy=False ):
+    # lazily loaded files only decode the sections which are accessed, which is used for importing subsets
+    return io_m3.M3SectionList.load( filepath, lazy=lazy )
+
+
+def m3_scan( filepath ):
+    '''Lists the names of the sequences, regions and particle systems of an m3 file, decoding only the sections needed for this'''
+    m3 = io_m3.M3SectionList.load( filepath, lazy=True )
     try:
+        model = m3.model
+        m3_bones = m3[model.bones]
+
+        def get_bone_name( bone_index ):
+            return m3[m3_bones[bone_index].name].content_to_string() if bone_index in range( len( m3_bones ) ) else ''
+
+        sequences = [m3[m3_seq.name].content_to_string() for m3_seq in m3[model.sequences]]
+
+        regions = []
+        if model.divisions.index and model.divisions.entries:
+            m3_division = m3[model.divisions][0]
+            m3_batches = m3[m3_division.batches]
+            for region_ii, region in enumerate( m3[m3_division.regions] ):
+                batch_count = len( [batch for batch in m3_batches if batch.region_index == region_ii] )
+                if batch_count:
+                    regions.append( ( region_ii, f'Region {region_ii} ({region.vertex_count} vertices, {batch_count} batches)' ) )
+
+        particle_systems = [( ii, get_bone_name( m3_system.bone ) or f'Particle System {ii}' ) for ii, m3_system in enumerate( m3[model.particle_systems] )]
+    finally:
+        m3.close()
+
+    return {
+        'sequences': list( enumerate( sequences ) ),
+        'regions': regions,
+        'particle_systems': particle_systems,
+    }
+
+
+class M3LoadThread( threading.Thread ):
+    '''Decodes an m3 file in the background. Only io_m3 is used here, since bpy data must not be touched outside of the main thread'''
+
+    def __init__( self, filepath, lazy=False ):
+        super().__init__( daemon=True )
+        self.filepath           = filepath
+        self.lazy               = lazy
+        self.m3                 = None
+        self.exception_trace    = ''
+        self.seconds            = None
+        self.cancelled          = False
+        self.lock               = threading.Lock()
+
+    def run( self ):
+        time_start = time.perf_counter()
+        try:
+            m3 = m3_load( self.filepath, self.lazy )
+            self.seconds = time.perf_counter() - time_start
+        except Exception:
+            self.exception_trace = traceback.format_exc()
+            return
+
+        with self.lock:
+            if self.cancelled:
+                m3.close()
+            else:
+                self.m3 = m3
+
+    def cancel( self ):
+        '''Closes the loaded file, or the file once it is loaded, if the import stages were never started with it'''
+        with self.lock:
+            self.cancelled = True
+            if self.m3 is not None:
+                self.m3.close()
+                self.m3 = None
+
+
+def m3_import_stages( filepath, ob=None, bl_op=None, opts=None, m3=None, subset=None, timings_path='', load_seconds=None, key_tolerance=0.0 ):
+    '''
+        Yields (index, count, name) before each import stage, handling errors and reports in the same way as m3_import.
+        load_seconds is the time taken to load m3, if it has been loaded already
+        '''
+    importer = Importer( bl_op, timings_path, key_tolerance )
+    importer.filepath = filepath
+    try:
+        if m3 is None:
+            m3 = importer.timed( 'load', m3_load, filepath, lazy=bool( subset ) )
+        elif load_seconds is not None:
+            importer.timings.append( ( 'load', load_seconds ) )
+
         if ob and filepath.endswith( '.m3a' ):
-            importer.m3a_import( filepath, ob )
+            yield 0, 1, 'm3a_import'
+            importer.ob = ob
+            data_existing = importer.data_existing_get()
+            importer.timed( 'm3a_import', importer.m3a_import, filepath, ob, m3=m3, subset=subset )
+            importer.data_counts_set( data_existing )
         elif ob:
-            importer.m3_import( filepath, ob, opts=opts )
+            yield from importer.m3_import_stages( filepath, ob, opts=opts, m3=m3, subset=subset )
         else:
-            importer.m3_import( filepath, ob )
+            yield from importer.m3_import_stages( filepath, ob, m3=m3, subset=subset )
     except Exception as e:
         if type(e) != AssertionError:
             importer.exception_trace = traceback.format_exc()
     finally:
+        if m3 is not None:
+            m3.close()
         importer.do_report()
+
+
+def m3_import( filepath, ob=None, bl_op=None, opts=None, subset=None, timings_path='', key_tolerance=0.0 ):
+    for stage in m3_import_stages( filepath, ob, bl_op, opts, subset=subset, timings_path=timings_path, key_tolerance=key_tolerance ):
+        pass
@@ -20,6 +20,7 @@
 # ##### END GPL LICENSE BLOCK #####
 
 import mathutils
+import numpy as np
 
 rot_fix_matrix = mathutils.Matrix(((0, 1, 0, 0),
                                   (-1, 0, 0, 0),
@@ -29,6 +30,77 @@ rot_fix_matrix = mathutils.Matrix(((0, 1, 0, 0),
 rot_fix_matrix_transpose = rot_fix_matrix.transposed()
 
 
+def quats_slerp(quats0, quats1, factors):
+    dots = (quats0 * quats1).sum(axis=1)
+    # the second quaternion is negated where needed, so that the shorter path between the rotations is taken
+    quats1 = np.where(dots[:, None] < 0, -quats1, quats1)
+    thetas = np.arccos(np.clip(np.abs(dots), 0.0, 1.0))
+    sins = np.sin(thetas)
+    # nearly equal rotations are interpolated linearly to avoid dividing by zero
+    small = sins < 0.000001
+    sins[small] = 1.0
+    weights0 = np.where(small, 1.0 - factors, np.sin((1.0 - factors) * thetas) / sins)
+    weights1 = np.where(small, factors, np.sin(factors * thetas) / sins)
+    return weights0[:, None] * quats0 + weights1[:, None] * quats1
+
+
+def quats_sign_aligned(quats):
+    '''Copy of quats in which each quaternion is negated if needed to be on the same side as the previous one'''
+    signs = np.where((quats[1:] * quats[:-1]).sum(axis=1) < 0, -1.0, 1.0)
+    return quats * np.concatenate(([1.0], np.cumprod(signs)))[:, None]
+
+
+def keys_errors(values0, values1, values, factors, interpolation):
+    '''Errors of values from the interpolation between values0 and values1 at factors, which are infinite where the interpolation is undefined'''
+    if interpolation == 'CONSTANT':
+        return np.abs(values - values0).max(axis=1)
+
+    if interpolation == 'SLERP':
+        interpolated = quats_slerp(np.tile(values0, (len(values), 1)), np.tile(values1, (len(values), 1)), factors)
+    else:
+        interpolated = values0 + factors[:, None] * (values1 - values0)
+
+    if interpolation == 'LINEAR':
+        return np.abs(values - interpolated).max(axis=1)
+
+    # quaternions are compared by the angle between the rotations
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dots = np.abs((interpolated * values).sum(axis=1)) / (np.linalg.norm(interpolated, axis=1) * np.linalg.norm(values, axis=1))
+        errors = 2 * np.arccos(np.minimum(dots, 1.0))
+    errors[~np.isfinite(errors)] = np.inf
+    return errors
+
+
+def keys_reduce(frames, values, tolerance, interpolation='LINEAR', keep=None):
+    '''
+        Mask of the keys to keep so that the kept keys reproduce all values within tolerance, splitting each span at its worst key.
+        values has a row per frame, and the keys set in keep are always kept along with the first and last keys.
+        interpolation is one of CONSTANT, LINEAR, SLERP or QUATERNION_LINEAR, which is the per component blend that blender evaluates
+        quaternion fcurves with. Quaternion tolerances are angles in radians.
+        '''
+    keep = np.zeros(len(frames), dtype=bool) if keep is None else keep.copy()
+    keep[0] = keep[-1] = True
+
+    kept_indices = np.flatnonzero(keep).tolist()
+    segments = list(zip(kept_indices[:-1], kept_indices[1:]))
+    while segments:
+        left, right = segments.pop()
+        if right - left < 2:
+            continue
+
+        factors = (frames[left + 1:right] - frames[left]) / (frames[right] - frames[left])
+        errors = keys_errors(values[left], values[right], values[left + 1:right], factors, interpolation)
+
+        max_index = int(np.argmax(errors))
+        if errors[max_index] > tolerance:
+            split = left + 1 + max_index
+            keep[split] = True
+            segments.append((left, split))
+            segments.append((split, right))
+
+    return keep
+
+
 def io_anim_group(processor):
     processor.float('movement_speed')
     processor.integer('frequency')
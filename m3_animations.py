@@ -74,6 +74,46 @@ def set_default_value(action, path, index, value):
     fcurve.keyframe_points.insert(0, value)
 
 
+# this class is exported to io_m3_import.py
+class DefaultValueBatch:
+    '''Collects default values of the _DEFAULTS action so that their fcurves can be written in a single pass'''
+
+    def __init__(self, ob):
+        self.ob = ob
+        self.path_values = {}
+
+    def set(self, path, index, value):
+        try:
+            self.path_values[path][index] = value
+        except KeyError:
+            self.path_values[path] = {index: value}
+
+    def flush(self):
+        if not self.path_values:
+            return
+
+        if self.ob.m3_animations_default is None:
+            self.ob.m3_animations_default = bpy.data.actions.new(self.ob.name + '_DEFAULTS')
+
+        fcurves = self.ob.m3_animations_default.fcurves
+        existing_fcurves = {(fcurve.data_path, fcurve.array_index): fcurve for fcurve in fcurves}
+
+        for path, index_values in self.path_values.items():
+            for index, value in index_values.items():
+                fcurve = existing_fcurves.get((path, index))
+
+                # existing curves may already hold other keys, so only replace the key on frame 0
+                if fcurve:
+                    fcurve.keyframe_points.insert(0, value)
+                    continue
+
+                fcurve = fcurves.new(path, index=index)
+                fcurve.keyframe_points.add(1)
+                fcurve.keyframe_points.foreach_set('co', (0.0, float(value)))
+
+        self.path_values = {}
+
+
 def anim_update(self, context):
     if context.object and context.object.m3_options.update_anim_data:
         anim = None
@@ -46,6 +46,7 @@ def get_bone_handle(self):
 def set_bone_handle(self, value):
     bone = self.id_data.data.bones.get(self.name)
     bone['bl_handle'] = value
+    shared.m3_pointer_cache_clear(self.id_data.pose.bones)
 
 
 bone_anim_props = ['m3_location_hex_id', 'm3_rotation_hex_id', 'm3_scale_hex_id', 'm3_batching_hex_id']
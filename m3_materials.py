@@ -345,6 +345,74 @@ def m3_material_get(matref):
     return mat
 
 
+# this function is exported to io_m3_import.py
+def m3_materials_prune(ob, start=0):
+    '''Removes the material references from the start index onward which are not used by any m3 data'''
+    matrefs = ob.m3_materialrefs
+
+    user_names = set()
+    for particle_system in ob.m3_particlesystems:
+        user_names.add(particle_system.material.value)
+    for ribbon in ob.m3_ribbons:
+        user_names.add(ribbon.material.value)
+    for projection in ob.m3_projections:
+        user_names.add(projection.material.value)
+    for child in ob.children_recursive:
+        if child.type != 'MESH':
+            continue
+        for mesh_batch in child.m3_mesh_batches:
+            user_names.add(mesh_batch.material.value)
+
+    # materials of composite sections are only in use if the composite material itself is
+    composite_section_names = {}
+    for matref in matrefs:
+        if matref.mat_type == 'm3_materials_composite':
+            mat = m3_material_get(matref)
+            if mat:
+                composite_section_names[matref.name] = [section.material.value for section in mat.sections]
+
+    user_names.update(matref.name for matref in matrefs[:start])
+    check_names = list(user_names)
+    while check_names:
+        for name in composite_section_names.get(check_names.pop(), ()):
+            if name not in user_names:
+                user_names.add(name)
+                check_names.append(name)
+
+    remove_indices = [ii for ii in range(start, len(matrefs)) if matrefs[ii].name not in user_names]
+    if not remove_indices:
+        return
+
+    mat_type_removed_indices = {}
+    mat_type_handle_indices = {}
+    for ii in remove_indices:
+        matref = matrefs[ii]
+        try:
+            handle_indices = mat_type_handle_indices[matref.mat_type]
+        except KeyError:
+            handle_indices = {item.bl_handle: jj for jj, item in enumerate(getattr(ob, matref.mat_type))}
+            mat_type_handle_indices[matref.mat_type] = handle_indices
+
+        mat_ii = handle_indices.get(matref.mat_handle)
+        if mat_ii is not None:
+            mat_type_removed_indices.setdefault(matref.mat_type, []).append(mat_ii)
+
+    for mat_type, indices in mat_type_removed_indices.items():
+        mat_col = getattr(ob, mat_type)
+        for ii in sorted(indices, reverse=True):
+            mat_col.remove(ii)
+        shared.m3_pointer_cache_clear(mat_col)
+
+    for ii in reversed(remove_indices):
+        matrefs.remove(ii)
+    shared.m3_pointer_cache_clear(matrefs)
+
+    shared.remap_m3_action_keyframes(ob, mat_type_removed_indices)
+
+    if ob.m3_materialrefs_index >= len(matrefs):
+        ob.m3_materialrefs_index = len(matrefs) - 1
+
+
 def m3_material_layer_get(ob, handle):
     for layer in ob.m3_materiallayers:
         if layer.bl_handle == handle:
@@ -879,6 +947,8 @@ class M3MaterialOpRemove(bpy.types.Operator):
                 break
 
         ob.m3_materialrefs.remove(ob.m3_materialrefs_index)
+        shared.m3_pointer_cache_clear(mat_col)
+        shared.m3_pointer_cache_clear(ob.m3_materialrefs)
 
         shared.remove_m3_action_keyframes(ob, matref.mat_type, mat_ii)
         for ii in range(mat_ii, len(matrefs)):
@@ -903,6 +973,7 @@ class M3MaterialOpMove(bpy.types.Operator):
 
         if (ob.m3_materialrefs_index < len(matrefs) - self.shift and ob.m3_materialrefs_index >= -self.shift):
             matrefs.move(ob.m3_materialrefs_index, ob.m3_materialrefs_index + self.shift)
+            shared.m3_pointer_cache_clear(matrefs)
             ob.m3_materialrefs_index += self.shift
 
         return {'FINISHED'}
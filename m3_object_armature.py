@@ -45,6 +45,11 @@ class ExportOptionsGroup( bpy.types.PropertyGroup ):
     cull_unused_bones: bpy.props.BoolProperty(default=True, name='Cull Unused Bones', description='Bones which the exporter determines will not be referenced in the m3 file are removed')
     cull_material_layers: bpy.props.BoolProperty(default=True, name='Cull Material Layers', description='Fills all blank material layer slots with a reference to a single layer section, which reduces file size. When turned off, output will conform to Blizzard standards, where all available material layer slots are filled with a unique layer section.')
     use_only_max_bounds: bpy.props.BoolProperty(default=False, name='Use Only Max Bounds', description='Rather than having multiple bounding box keys, animations will have exactly one bounding box key which has the maximum dimensions of all the keys there would have been. Can slightly reduce file size')
+    use_cache: bpy.props.BoolProperty(
+        default=True, name='Reuse Unchanged Data',
+        description='Reuse the vertex data of unchanged meshes and the bone animation of unchanged actions from a previous export of the open file. '
+                    'The output is the same as without reuse',
+    )
 
 
 def register_props():
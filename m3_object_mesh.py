@@ -91,6 +91,16 @@ def bm_layer_cloth_sim(bm):
     return bm.verts.layers.int.get('m3clothsim') or bm.verts.layers.int.new('m3clothsim')
 
 
+# this function is exported to io_m3_import.py
+def me_attribute_cloth_sim(me):
+    # same data as the bmesh layer of bm_layer_cloth_sim, but accessible in object mode
+    attribute = me.attributes.get('m3clothsim')
+    if attribute and (attribute.domain != 'POINT' or attribute.data_type != 'INT'):
+        me.attributes.remove(attribute)
+        attribute = None
+    return attribute or me.attributes.new('m3clothsim', 'INT', 'POINT')
+
+
 class Panel(bpy.types.Panel):
     bl_idname = 'OBJECT_PT_M3_GENERAL'
     bl_label = 'M3 Properties'
@@ -17,7 +17,9 @@
 # ##### END GPL LICENSE BLOCK #####
 
 import bpy
+import bisect
 import random
+from bpy.app.handlers import persistent
 from . import bl_enum
 
 
@@ -140,6 +142,7 @@ def m3_item_get_name(collection, prefix='', suggest=True):
 def m3_item_add(collection, item_name=''):
     item = collection.add()
     item['bl_handle'] = m3_handle_gen()
+    m3_pointer_cache_clear(collection)
     item['name'] = m3_item_get_name(collection, item_name)
 
     for key in type(item).__annotations__.keys():
@@ -167,6 +170,7 @@ def m3_item_duplicate(collection, src, dup_action_keyframes, dst_collection=None
 
     if (type(dst) != type(src)):
         collection.remove(len(collection) - 1)
+        m3_pointer_cache_clear(collection)
         return None
 
     dup_actions = []
@@ -239,13 +243,148 @@ def m3_collection_index_set(bl, value):
         setattr(ob.path_resolve(rsp[0]), rsp[1] + '_index', value)
 
 
+# maps (id pointer, collection path) to (dict of handle to collection index, set of handles not found in the collection)
+m3_pointer_cache = {}
+
+
+def m3_pointer_cache_key(search_data):
+    try:
+        return (search_data.id_data.as_pointer(), search_data.path_from_id())
+    except (AttributeError, ValueError):
+        return None  # not an rna collection, such as a python list
+
+
+def m3_pointer_cache_build(search_data, key):
+    handle_indices = {}
+    for ii, item in enumerate(search_data):
+        handle_indices.setdefault(item.bl_handle, ii)
+    m3_pointer_cache[key] = (handle_indices, set())
+    return m3_pointer_cache[key]
+
+
+# this function should be called whenever items of a collection are added, removed, moved or have their handle changed
+def m3_pointer_cache_clear(search_data=None):
+    if search_data is None:
+        m3_pointer_cache.clear()
+        m3_anim_id_props_cache.clear()
+        return
+
+    key = m3_pointer_cache_key(search_data)
+    if key is not None:
+        m3_pointer_cache.pop(key, None)
+        if key[1].split('[', 1)[0].split('.', 1)[0] in m3_anim_id_collections:
+            m3_anim_id_props_cache.pop(key[0], None)
+
+
+@persistent
+def m3_pointer_cache_clear_handler(*args):
+    m3_pointer_cache_clear()
+
+
+# object collections which may hold animated properties that are imported from m3a files
+m3_anim_id_collections = (
+    'm3_cameras', 'm3_forces', 'm3_lights', 'm3_materiallayers', 'm3_materials_standard', 'm3_materials_displacement',
+    'm3_materials_composite', 'm3_materials_volume', 'm3_materials_volumenoise', 'm3_materials_reflection', 'm3_materials_lensflare',
+    'm3_particlesystems', 'm3_particlecopies', 'm3_projections', 'm3_ribbons', 'm3_ribbonsplines', 'm3_shadowboxes', 'm3_warps',
+)
+
+# maps id pointer to (collection lengths, dict of anim id to list of property paths)
+m3_anim_id_props_cache = {}
+# maps property group class to (anim header keys, collection keys)
+m3_anim_id_class_keys = {}
+
+
+def m3_anim_id_props_build(ob):
+    anim_id_to_props = {}
+
+    def get_class_keys(item):
+        try:
+            return m3_anim_id_class_keys[type(item)]
+        except KeyError:
+            header_keys = []
+            collection_keys = []
+            for key in type(item).__annotations__.keys():
+                prop = getattr(item, key)
+                if type(prop) == M3AnimHeaderProp:
+                    header_keys.append(key)
+                elif str(type(prop)) == '<class \'bpy_prop_collection_idprop\'>':
+                    collection_keys.append(key)
+            class_keys = m3_anim_id_class_keys[type(item)] = (header_keys, collection_keys)
+            return class_keys
+
+    def get_anim_ids(collection):
+        for item in collection:
+            header_keys, collection_keys = get_class_keys(item)
+            for key in header_keys:
+                prop = getattr(item, key)
+                prop_path = prop.path_from_id()[:-7]  # removing the _header suffix
+                prop_id_int = int(prop.hex_id, 16)
+                try:
+                    anim_id_to_props[prop_id_int].append(prop_path)
+                except KeyError:
+                    anim_id_to_props[prop_id_int] = [prop_path]
+            for key in collection_keys:
+                get_anim_ids(getattr(item, key))
+
+    for collection_name in m3_anim_id_collections:
+        get_anim_ids(getattr(ob, collection_name))
+
+    return anim_id_to_props
+
+
+def m3_anim_id_props_get(ob):
+    '''Returns a dict of anim id to property paths of the object, which is cached until the m3 collections of the object change'''
+    # collection lengths are compared as well, in case a collection is changed without clearing the cache
+    collection_lens = tuple(len(getattr(ob, collection_name)) for collection_name in m3_anim_id_collections)
+    key = ob.as_pointer()
+
+    cached = m3_anim_id_props_cache.get(key)
+    if cached and cached[0] == collection_lens:
+        return cached[1]
+
+    anim_id_to_props = m3_anim_id_props_build(ob)
+    m3_anim_id_props_cache[key] = (collection_lens, anim_id_to_props)
+    return anim_id_to_props
+
+
 def m3_pointer_get(search_data, pointer):
     handle = pointer.handle if type(pointer) != str else pointer
     if not handle:
         return None
-    for item in search_data:
+
+    key = m3_pointer_cache_key(search_data)
+
+    if key is None:
+        for item in search_data:
+            if item.bl_handle == handle:
+                return item
+        return None
+
+    cached = m3_pointer_cache.get(key)
+    is_new = cached is None
+    if is_new:
+        cached = m3_pointer_cache_build(search_data, key)
+
+    handle_indices, missed_handles = cached
+
+    # dangling handles are remembered until the cache is cleared, so that they do not rebuild the map on every lookup
+    if handle in missed_handles:
+        return None
+
+    # the cached index is verified, since collections can change outside of the invalidating functions (undo, edit mode, etc.)
+    ii = handle_indices.get(handle)
+    if ii is not None and ii < len(search_data):
+        item = search_data[ii]
         if item.bl_handle == handle:
             return item
+
+    if not is_new:
+        handle_indices, missed_handles = m3_pointer_cache_build(search_data, key)
+        ii = handle_indices.get(handle)
+        if ii is not None:
+            return search_data[ii]
+
+    missed_handles.add(handle)
     return None
 
 
@@ -419,6 +558,7 @@ def hex_id_set(self, value):
         self['hex_id'] = hex(int(value, 16))[2:]
     except ValueError:
         self['hex_id'] = m3_anim_id_gen()
+    m3_anim_id_props_cache.pop(self.id_data.as_pointer(), None)
 
 
 class M3AnimHeaderProp(bpy.types.PropertyGroup):
@@ -488,6 +628,7 @@ class M3CollectionOpRemove(M3CollectionOpBase):
             return {'FINISHED'}
 
         collection.remove(self.index)
+        m3_pointer_cache_clear(collection)
 
         remove_m3_action_keyframes(context.object, self.collection, self.index)
         for ii in range(self.index, len(collection)):
@@ -508,6 +649,7 @@ class M3CollectionOpMove(M3CollectionOpBase):
 
         if (self.index < len(collection) - self.shift and self.index >= -self.shift):
             collection.move(self.index, self.index + self.shift)
+            m3_pointer_cache_clear(collection)
             swap_m3_action_keyframes(context.object, self.collection, self.index, self.index + self.shift)
             m3_collection_index_set(collection, self.index + self.shift)
 
@@ -551,7 +693,9 @@ class M3HandleListOpRemove(M3CollectionOpBase):
     index: bpy.props.IntProperty(options=set())
 
     def invoke(self, context, event):
-        context.object.path_resolve(self.collection).remove(self.index)
+        collection = context.object.path_resolve(self.collection)
+        collection.remove(self.index)
+        m3_pointer_cache_clear(collection)
         return {'FINISHED'}
 
 
@@ -561,6 +705,7 @@ def m3_data_handles_verify(data):
         if not item.bl_handle or item.bl_handle in handles:
             item.bl_handle = m3_handle_gen()
         handles.add(item.bl_handle)
+    m3_pointer_cache_clear(data)
 
 
 def m3_data_handles_enum(self, context):
@@ -890,6 +1035,37 @@ def shift_m3_action_keyframes(ob, prefix, index, offset=-1):
             fcurve.data_path = fcurve.data_path.replace(path, f'{prefix}[{index + offset}]')
 
 
+def remap_m3_action_keyframes(ob, prefix_removed_indices):
+    '''Removes and shifts the fcurves of several removed collection items in a single pass over the actions'''
+    update_actions = {ob.m3_animations_default} if ob.m3_animations_default else set()
+
+    for anim_group in ob.m3_animation_groups:
+        for anim in anim_group.animations:
+            if anim.action:
+                update_actions.add(anim.action)
+
+    prefix_removed_indices = {prefix: sorted(indices) for prefix, indices in prefix_removed_indices.items() if indices}
+
+    for action in update_actions:
+        for fcurve in list(action.fcurves):
+            prefix, sep, remainder = fcurve.data_path.partition('[')
+            removed_indices = prefix_removed_indices.get(prefix)
+            if not sep or not removed_indices:
+                continue
+
+            index_str, sep, path_suffix = remainder.partition(']')
+            if not index_str.isdigit():
+                continue
+
+            index = int(index_str)
+            offset = bisect.bisect_left(removed_indices, index)
+
+            if offset < len(removed_indices) and removed_indices[offset] == index:
+                action.fcurves.remove(fcurve)
+            elif offset:
+                fcurve.data_path = f'{prefix}[{index - offset}]{path_suffix}'
+
+
 def swap_m3_action_keyframes(ob, prefix, old, new):
 
     update_actions = {ob.m3_animations_default} if ob.m3_animations_default else {}
@@ -0,0 +1,90 @@
+import importlib.util
+import os
+import warnings
+import numpy as np
+
+# io_shared only needs mathutils and numpy, so it is loaded without the addon package, which needs bpy
+spec = importlib.util.spec_from_file_location('io_shared', os.path.join(os.path.dirname(__file__), os.pardir, 'io_shared.py'))
+io_shared = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(io_shared)
+
+
+def turn_quats(angles):
+    return np.array([(np.cos(angle / 2), 0.0, 0.0, np.sin(angle / 2)) for angle in angles])
+
+
+def quats_angles(quats0, quats1):
+    dots = np.abs((quats0 * quats1).sum(axis=1)) / (np.linalg.norm(quats0, axis=1) * np.linalg.norm(quats1, axis=1))
+    return 2 * np.arccos(np.minimum(dots, 1.0))
+
+
+def reduced_errors(frames, quats, keep, interpolation):
+    '''Angles between quats and their interpolation from the kept keys, on every frame'''
+    kept = np.flatnonzero(keep)
+    errors = np.zeros(len(frames))
+    for left, right in zip(kept[:-1], kept[1:]):
+        factors = (frames[left:right + 1] - frames[left]) / (frames[right] - frames[left])
+        if interpolation == 'SLERP':
+            interpolated = io_shared.quats_slerp(np.tile(quats[left], (len(factors), 1)), np.tile(quats[right], (len(factors), 1)), factors)
+        else:
+            interpolated = quats[left] + factors[:, None] * (quats[right] - quats[left])
+        errors[left:right + 1] = quats_angles(interpolated, quats[left:right + 1])
+    return errors
+
+
+def test_slerp_takes_shortest_path():
+    quats0 = turn_quats([0.0])
+    quats1 = -turn_quats([0.5])
+    interpolated = io_shared.quats_slerp(quats0, quats1, np.array([0.5]))
+    assert quats_angles(interpolated, turn_quats([0.25]))[0] < 0.000001
+
+
+def test_sign_aligned():
+    quats = turn_quats(np.linspace(0, 1, 5)) * np.array([1, -1, -1, 1, -1])[:, None]
+    aligned = io_shared.quats_sign_aligned(quats)
+    assert ((aligned[1:] * aligned[:-1]).sum(axis=1) > 0).all()
+    assert np.allclose(np.abs(aligned), np.abs(quats))
+
+
+def test_full_turn():
+    frames = np.arange(21, dtype=np.float64)
+    quats = turn_quats(np.linspace(0, 2 * np.pi, 21))
+    tolerance = 0.001
+
+    for interpolation in ('SLERP', 'QUATERNION_LINEAR'):
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            keep = io_shared.keys_reduce(frames, quats, tolerance, interpolation)
+
+        # the ends are the same rotation, so the inner keys can not all be dropped
+        assert keep.sum() >= 3
+        assert reduced_errors(frames, quats, keep, interpolation).max() <= tolerance
+
+
+def test_sign_flipped_keys():
+    frames = np.arange(30, dtype=np.float64)
+    quats = turn_quats(np.linspace(0, 1, 30))
+    quats[1::2] *= -1
+    tolerance = 0.001
+
+    keep = io_shared.keys_reduce(frames, quats, tolerance, 'SLERP')
+    assert keep.sum() == 2
+    assert reduced_errors(frames, quats, keep, 'SLERP').max() <= tolerance
+
+    # blending per component only gives the shortest path once the signs are aligned
+    aligned = io_shared.quats_sign_aligned(quats)
+    keep = io_shared.keys_reduce(frames, aligned, tolerance, 'QUATERNION_LINEAR')
+    assert keep.sum() < len(frames)
+    assert reduced_errors(frames, aligned, keep, 'QUATERNION_LINEAR').max() <= tolerance
+
+
+def test_kept_keys():
+    frames = np.arange(40, dtype=np.float64)
+    quats = turn_quats(np.linspace(0, 2 * np.pi, 40))
+    keep = np.zeros(len(frames), dtype=bool)
+    keep[7] = True
+
+    reduced = io_shared.keys_reduce(frames, quats, 0.0002, 'SLERP', keep=keep)
+    assert reduced[[0, 7, 39]].all()
+    assert not keep[0]
+    assert reduced_errors(frames, quats, reduced, 'SLERP').max() <= 0.0002